@@ -0,0 +1,193 @@
+#####################################################################################
+#
+#  Blender2P3D/FSX
+#
+#####################################################################################
+#
+# The addon in its current version is the hard work of many members of the
+# fsdeveloper.com forum. The original FSX2Blender addon was developed by:
+#   Felix Owono-Ateba
+#   Ron Haertel
+#   Kris Pyatt (2017)
+#   Manochvarma Raman (2018)
+#
+# This current incarnation of the addon uses most of the original algorithms,
+# but with an updated UI and compatibility for Blender 2.8x. Parts of the
+# original exporter script have been re-written to accommodate Blender's new
+# material workflow and to add PBR support to the addon (P3D v4.4+/v5 only).
+#
+# The conversion for Blender 2.8x was done by:
+#   Otmar Nitsche (2019/2020)
+#
+# Further enhancement to the material workflow were coded by:
+#   David Hoeffgen (2020)
+#
+# For information on how to use the addon, please visit:
+# https://www.fsdeveloper.com/wiki/index.php?title=Blender2P3D/FSX
+#
+# If you have any questions, or suggestions, visit the support thread under:
+# https://www.fsdeveloper.com/forum/forums/blender.136/
+#
+# For the original Blender2FSX addon, visit:
+# https://www.fsdeveloper.com/forum/threads/blender2fsx-p3d-v0-9-5-onwards.442082/
+#
+# Special thanks go to Arno Gerretsen and Bill Womack for their input during the
+# development and testing of the addon.
+#
+# The software is licensed under GNU General Public License (GNU-GPL-3).
+# Feel free to use it as you see fit, both for freeware and commercial projects.
+# If you have suggestions for changes, use the support thread in the
+# fsdeveloper.com forum. If you would like to get involved in the development
+# of the addon, contact any of the authors mentioned above to coordinate
+# the effort.
+#
+#####################################################################################
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#####################################################################################
+
+import bpy
+import hashlib
+import os
+
+
+# On-disk cache of serialized chunks of the .x file, addressed by a hash of
+# everything that went into them.  An object whose data did not change since
+# the last export is spliced in from the cache instead of being formatted
+# again.  Salt holds whatever applies to the whole export (add-on version,
+# options), so changing it invalidates every chunk.
+class ChunkCache:
+    def __init__(self, Directory, Salt=""):
+        self.Directory = Directory
+        self.Salt = Salt
+        self.Hits = 0
+        self.Misses = 0
+
+    def __repr__(self):
+        return "[ChunkCache: {}]".format(self.Directory)
+
+    # Key of the chunk made from Parts, which must have a stable repr
+    def Key(self, *Parts):
+        Hash = hashlib.blake2b(digest_size=20)
+        Hash.update(repr((self.Salt,) + Parts).encode("utf-8"))
+        return Hash.hexdigest()
+
+    # Returns the cached chunk, or None
+    def Get(self, Key):
+        try:
+            with open(self.__Path(Key), 'rb') as ChunkFile:
+                Chunk = ChunkFile.read()
+        except OSError:
+            self.Misses += 1
+            return None
+        self.Hits += 1
+        return Chunk
+
+    # Stores a chunk.  It goes to a temporary file first, so an interrupted
+    # export never leaves half a chunk behind.  A cache that cannot be
+    # written to is not an export error.
+    def Put(self, Key, Chunk):
+        Path = self.__Path(Key)
+        try:
+            os.makedirs(self.Directory, exist_ok=True)
+            with open(Path + ".tmp", 'wb') as ChunkFile:
+                ChunkFile.write(Chunk)
+            os.replace(Path + ".tmp", Path)
+        except OSError:
+            pass
+
+    def __Path(self, Key):
+        return os.path.join(self.Directory, Key + ".chunk")
+
+
+# Properties that change without affecting the export (UI state)
+_VolatileProperties = {"rna_type", "users", "select", "location", "width", "height", "dimensions",
+                       "hide", "show_options", "show_preview", "show_expanded", "is_active"}
+
+
+def _Plain(Value):
+    if isinstance(Value, bpy.types.ID):
+        return Value.name
+    if isinstance(Value, set):
+        return tuple(sorted(Value))
+    if hasattr(Value, "__len__") and not isinstance(Value, str):
+        return tuple(_Plain(Item) for Item in Value)
+    return Value
+
+
+# Values of all the RNA properties of Struct, as a string.  Data-blocks it
+# points to are represented by their name, nested structs and collections
+# are left out.
+def RnaSignature(Struct):
+    Values = []
+    for Property in Struct.bl_rna.properties:
+        if Property.identifier in _VolatileProperties or Property.type == 'COLLECTION':
+            continue
+        try:
+            Value = getattr(Struct, Property.identifier)
+        except AttributeError:
+            continue
+        if Property.type == 'POINTER' and not isinstance(Value, bpy.types.ID):
+            continue
+        Values.append((Property.identifier, _Plain(Value)))
+    return repr(Values)
+
+
+# Everything the material writers read from a material: its properties
+# (the fsxm_ ones included) and its node tree.
+def MaterialSignature(Material):
+    if Material is None:
+        return None
+    Nodes = []
+    if Material.node_tree is not None:
+        for Node in sorted(Material.node_tree.nodes, key=lambda Node: Node.name):
+            Image = getattr(Node, "image", None)
+            Nodes.append((RnaSignature(Node),
+                          [(Input.identifier, _Plain(getattr(Input, "default_value", None)))
+                           for Input in Node.inputs],
+                          (Image.name, Image.filepath) if Image is not None else None))
+        Links = sorted((Link.from_node.name, Link.from_socket.identifier,
+                        Link.to_node.name, Link.to_socket.identifier)
+                       for Link in Material.node_tree.links)
+    else:
+        Links = []
+    return (Material.name, RnaSignature(Material), Nodes, Links)
+
+
+# The modifier stack of Object, and the vertex groups and armature bones the
+# skin weights are written from.
+def ModifierSignature(Object):
+    Modifiers = [RnaSignature(Modifier) for Modifier in Object.modifiers]
+    Groups = [(Group.index, Group.name) for Group in Object.vertex_groups]
+    Bones = [(Modifier.object.name, [Bone.name for Bone in Modifier.object.pose.bones])
+             for Modifier in Object.modifiers
+             if Modifier.type == 'ARMATURE' and Modifier.object is not None]
+    return (Modifiers, Groups, Bones)
+
+
+# What the skin weights take from outside the mesh: the offset matrix of
+# each bone depends on the world matrices of Object and its armatures and on
+# the rest matrices of the bones, and the bones are referred to by their
+# frame names.
+def SkinSignature(Object, FrameNames):
+    Armatures = []
+    for Modifier in Object.modifiers:
+        if Modifier.type != 'ARMATURE' or Modifier.object is None:
+            continue
+        Armature = Modifier.object
+        Armatures.append((Armature.name, _Plain(Armature.matrix_world),
+                          [(Bone.name, _Plain(Bone.matrix_local), FrameNames.Get(Bone, None))
+                           for Bone in Armature.data.bones]))
+    return (_Plain(Object.matrix_world), Armatures)
@@ -0,0 +1,151 @@
+#####################################################################################
+#
+#  Blender2P3D/FSX
+#
+#####################################################################################
+#
+# The addon in its current version is the hard work of many members of the
+# fsdeveloper.com forum. The original FSX2Blender addon was developed by:
+#   Felix Owono-Ateba
+#   Ron Haertel
+#   Kris Pyatt (2017)
+#   Manochvarma Raman (2018)
+#
+# This current incarnation of the addon uses most of the original algorithms,
+# but with an updated UI and compatibility for Blender 2.8x. Parts of the
+# original exporter script have been re-written to accommodate Blender's new
+# material workflow and to add PBR support to the addon (P3D v4.4+/v5 only).
+#
+# The conversion for Blender 2.8x was done by:
+#   Otmar Nitsche (2019/2020)
+#
+# Further enhancement to the material workflow were coded by:
+#   David Hoeffgen (2020)
+#
+# For information on how to use the addon, please visit:
+# https://www.fsdeveloper.com/wiki/index.php?title=Blender2P3D/FSX
+#
+# If you have any questions, or suggestions, visit the support thread under:
+# https://www.fsdeveloper.com/forum/forums/blender.136/
+#
+# For the original Blender2FSX addon, visit:
+# https://www.fsdeveloper.com/forum/threads/blender2fsx-p3d-v0-9-5-onwards.442082/
+#
+# Special thanks go to Arno Gerretsen and Bill Womack for their input during the
+# development and testing of the addon.
+#
+# The software is licensed under GNU General Public License (GNU-GPL-3).
+# Feel free to use it as you see fit, both for freeware and commercial projects.
+# If you have suggestions for changes, use the support thread in the
+# fsdeveloper.com forum. If you would like to get involved in the development
+# of the addon, contact any of the authors mentioned above to coordinate
+# the effort.
+#
+#####################################################################################
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#####################################################################################
+
+import bpy
+from bpy.app.handlers import persistent
+
+
+# Record of one export target: the data-blocks that changed since it was
+# last exported successfully, the options it was exported with and the
+# cache keys of the mesh chunks written then, by object name and
+# indentation.
+class ChangeRecord:
+    def __init__(self, Salt, ChunkKeys):
+        self.Salt = Salt
+        self.ChunkKeys = ChunkKeys
+        self.Changed = set()
+
+    def __repr__(self):
+        return "[ChangeRecord: {} changes]".format(len(self.Changed))
+
+    # True if none of the data-blocks changed since the export
+    def IsClean(self, *IDs):
+        return not any((type(ID).__name__, ID.name) in self.Changed
+                       for ID in IDs if ID is not None)
+
+
+# Tracks the data-blocks changed since the last successful export of each
+# .x file, using the depsgraph update handler.  The depsgraph reports every
+# data-block it re-evaluated, so an object is also marked when something it
+# depends on (modifier target, parent, driver) changed.  Updates made by the
+# exporter itself are ignored.
+#
+# Records only live as long as the session and the .blend: loading a file,
+# undo and redo drop all of them, so the next export starts from scratch.
+class ChangeTracker:
+    Records = {}
+    Suspended = False
+
+    # Returns the record of the last successful export to FilePath, if it was
+    # made with the same Salt
+    @staticmethod
+    def Get(FilePath, Salt):
+        Record = ChangeTracker.Records.get(FilePath)
+        if Record is None or Record.Salt != Salt:
+            return None
+        return Record
+
+    # Starts a new record for FilePath after a successful export
+    @staticmethod
+    def Commit(FilePath, Salt, ChunkKeys):
+        ChangeTracker.Records[FilePath] = ChangeRecord(Salt, ChunkKeys)
+
+    @staticmethod
+    def Reset():
+        ChangeTracker.Records.clear()
+
+    @staticmethod
+    def Record(Depsgraph):
+        if ChangeTracker.Suspended or not ChangeTracker.Records:
+            return
+        Changed = set()
+        for Update in Depsgraph.updates:
+            ID = Update.id.original
+            Changed.add((type(ID).__name__, ID.name))
+        for Record in ChangeTracker.Records.values():
+            Record.Changed |= Changed
+
+
+@persistent
+def _DepsgraphUpdatePost(Scene, Depsgraph):
+    ChangeTracker.Record(Depsgraph)
+
+
+@persistent
+def _ResetChanges(*Arguments):
+    ChangeTracker.Reset()
+
+
+_ResetHandlers = (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post)
+
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(_DepsgraphUpdatePost)
+    for Handlers in _ResetHandlers:
+        Handlers.append(_ResetChanges)
+
+
+def unregister():
+    if _DepsgraphUpdatePost in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(_DepsgraphUpdatePost)
+    for Handlers in _ResetHandlers:
+        if _ResetChanges in Handlers:
+            Handlers.remove(_ResetChanges)
+    ChangeTracker.Reset()
@@ -63,6 +63,7 @@ import time, re, datetime
 import xml.etree.ElementTree as etree
 import sys
 import os
+from collections import Counter
 from mathutils import Vector, Matrix, Quaternion
 from bpy.path import basename, ensure_ext
 from os.path import getsize, exists, splitext
@@ -73,6 +74,8 @@ from bpy_types import Bone as bpy_types_Bone, PoseBone as bpy_types_PoseBone
 from . environment import *
 from . func_util import *
 from . li_export import *
+from . func_cache import ChunkCache, RnaSignature
+from . func_changes import ChangeTracker
 from . log_export import Log
 
 
@@ -80,13 +83,46 @@ class FSXExporter:
     def __init__(self, config, context, version):
         self.config = config
         self.context = context
-        self.File = File(self.config.filepath)
+        Compressed = self.config.XFileFormat in {'TZIP', 'BZIP'}
+        if self.config.XFileFormat in {'BINARY', 'BZIP'}:
+            self.File = BinaryFile(self.config.filepath, Compressed)
+        else:
+            self.File = File(self.config.filepath, Compressed, self.config.Jobs, self.config.Pipelined)
 
         # setting up the log:
         directory = os.path.dirname(self.config.filepath)
         self.logfilepath = Util.ReplaceFileNameExt(self.config.filepath, "-log.txt")
         self.log = Log(context, self.config, self.logfilepath, version)
 
+        # Cached mesh chunks are only valid for the same add-on version and
+        # options.  All the options go into the salt, not only the ones the
+        # mesh writers are known to read, so none can be forgotten; options
+        # that leave the meshes alone only cost a cold cache.
+        self.OptionSignature = (version, RnaSignature(self.config.properties), context.scene.global_sdk)
+        self.ChunkCache = None
+        if self.config.UseChunkCache or self.config.Incremental:
+            self.ChunkCache = ChunkCache(
+                Util.ReplaceFileNameExt(self.config.filepath, "-cache"), self.OptionSignature)
+            if not self.config.UseChunkCache:
+                self.log.log("Incremental export: mesh chunk cache turned on", False, True)
+
+        # With an incremental export, the changes recorded since the last
+        # export of this file with the same options decide which meshes are
+        # written again; the others come from the chunk cache, which it
+        # turns on.  Frames and animations are always written again: they
+        # are cheap next to the meshes, and the animation depends on more
+        # than the change record covers (drivers, constraints, parents).
+        # ChunkKeys collects the mesh chunks of this export for the next one.
+        self.Changes = None
+        if self.config.Incremental:
+            self.Changes = ChangeTracker.Get(self.config.filepath, self.OptionSignature)
+        self.ChunkKeys = {}
+
+        # The evaluated depsgraph all meshes are taken from, and the modifiers
+        # switched off for the export (see __DisableModifiers)
+        self.Depsgraph = None
+        self.DisabledModifiers = {}
+
         try:
             self.modeldefTree = etree.parse(context.scene.fsx_modeldefpath)
         except FileNotFoundError:
@@ -98,114 +134,79 @@ class FSXExporter:
 
         # ExportMap maps Blender objects to ExportObjects
         self.log.log("Gathering top-level objects from scene...", False, True)
-        ExportMap = {}
+        ExportMap = SceneGraph()
         for idx, Object in enumerate(self.context.scene.objects):
             Util.Update_Progress("Progress Objects: ", idx / len(self.context.scene.objects))
 
             if Object.type == 'EMPTY':
                 self.log.log("object found: %s [EMPTY]" % Object.name, True)
-                ExportMap[Object] = EmptyExportObject(self.config, self, Object)
+                ExportMap.Add(Object, EmptyExportObject(self.config, self, Object))
             elif Object.type == 'MESH':
                 self.log.log("object found: %s [MESH]" % Object.name, True)
-                ExportMap[Object] = MeshExportObject(self.config, self, Object)
+                ExportMap.Add(Object, MeshExportObject(self.config, self, Object))
             elif Object.type == 'ARMATURE':
                 self.log.log("object found: %s [ARMATURE]" % Object.name, True)
-                ExportMap[Object] = ArmatureExportObject(self.config, self, Object)
+                ExportMap.Add(Object, ArmatureExportObject(self.config, self, Object))
                 if self.config.ExportSkinWeights:
                     for Bone in Object.data.bones:
                         self.log.log("object found: %s [BONE]" % Bone.name, True)
-                        ExportMap[Bone] = BoneExportObject(self.config, self, Bone, Object)
+                        ExportMap.Add(Bone, BoneExportObject(self.config, self, Bone, Object))
         Util.Update_Progress("Progress Objects: ", 1)
         self.log.log("All top-level objects from scene gathered.", False, True)
         self.log.log("")
 
-        # write all children and parents
+        # link every object to its parent; an object parented to one that is
+        # not exported hangs from the closest ancestor that is
         self.log.log("Gathering child objects from scene...", False, True)
-        for idx, ob in enumerate(ExportMap.values()):
-            Util.Update_Progress("Progress Child Objects: ", idx / len(ExportMap.values()))
-            for child in ob.BlenderObject.children:
-                ob.Children.append(ExportMap[child])
-            if ob.BlenderObject.parent:
-                ob.Parent = ExportMap[ob.BlenderObject.parent]
+        for idx, Object in enumerate(list(ExportMap.Nodes)):
+            Util.Update_Progress("Progress Child Objects: ", idx / len(ExportMap))
+            Parent = Object.parent
+            while Parent is not None and Parent not in ExportMap:
+                Parent = Parent.parent
+            ExportMap.Link(Object, Parent)
         Util.Update_Progress("Progress Child Objects: ", 1)
         self.log.log("All child objects from scene gathered.", False, True)
         self.log.log("")
 
+        # Remove the objects that are not selected (the bones of an armature
+        # go with it) and all armatures - bones are kept.  The children of a
+        # removed object move up to the closest ancestor that is kept.
+        def Keep(Object, ExportObject):
+            if self.config.ExportSelection:
+                if ExportObject.type == 'BONE':
+                    Selected = ExportObject.ParentArmature.select_get()
+                else:
+                    Selected = Object.select_get()
+                if not Selected:
+                    self.log.log("object removed: %s [%s]" % (Object.name, type(Object)), False, True)
+                    return False
+            if ExportObject.type == 'ARMATURE':
+                self.log.log("object removed: %s {ARMATURE]" % Object.name, False, True)
+                return False
+            return True
+
         if self.config.ExportSelection:
             self.log.log("Removing un-selected objects from export list", False, True)
-            # first, find all roots among exportable types
-            RootList = [obj.BlenderObject for obj in ExportMap.values()
-                        if obj.BlenderObject.parent is None]
-            NoExportList = []
-
-            # recursive function, updates child-parent relation to fit selection
-            def swapparent(obj, NoExportList):
-                if type(obj) == bpy_types_Bone:
-                    BoneObj = ExportMap[obj]
-                    Arm = BoneObj.ParentArmature
-                    if Arm.select_get():
-                        return
-                    else:
-                        NoExportList.append(obj)
-                        for child in obj.children:
-                            swapparent(child, NoExportList)
-                        return
-
-                if not obj.select_get():
-                    NoExportList.append(obj)
-                    if ExportMap[obj].Parent:
-                        if ExportMap[obj] in ExportMap[obj].Parent.Children:
-                            ExportMap[obj].Parent.Children.remove(ExportMap[obj])
-                    for child in obj.children:
-                        if not ExportMap[obj].Parent:
-                            ExportMap[child].Parent = None
-                        else:
-                            ExportMap[child].Parent = ExportMap[obj].Parent
-                            if ExportMap[child] not in ExportMap[obj].Parent.Children:
-                                ExportMap[obj].Parent.Children.append(ExportMap[child])
-                        swapparent(child, NoExportList)
-                else:
-                    for child in obj.children:
-                        swapparent(child, NoExportList)
-
-            # update children and parents
-            for ob in RootList:
-                swapparent(ob, NoExportList)
-
-            # remove objects that are not selected
-            for ob in NoExportList:
-                self.log.log("object removed: %s [%s]" % (ob.name, type(ob)), False, True)
-                ExportMap.pop(ob)
-
-            del RootList
-            del NoExportList
-
-        # exclude all armatures from export - bones are kept
-        ArmList = []
-        for ob in ExportMap.values():
-            if ob.type == 'ARMATURE':
-                arm = ob.BlenderObject
-                ArmList.append(arm)
-                if ob.Parent:
-                    ob.Parent.Children.remove(ob)
-                for child in arm.children:
-                    if ob.Parent:
-                        ExportMap[child].Parent = ExportMap[arm.parent]
-                        ExportMap[arm.parent].Children.append(ExportMap[child])
-                    else:
-                        if ExportMap[child].Parent:
-                            ExportMap[child].Parent = None
-        for arm in ArmList:
-            self.log.log("object removed: %s {ARMATURE]" % arm.name, False, True)
-            ExportMap.pop(arm)
-
-        # list root level objects to be exported
-        self.RootExportList = [Object for Object in ExportMap.values()
-                               if Object.Parent is None]
-
-        # tidying up...
-        self.RootExportList = Util.SortByNameField(self.RootExportList)
-        self.ExportList = Util.SortByNameField(ExportMap.values())
+        ExportMap.Prune(Keep)
+
+        # list root level objects to be exported, everything sorted by name
+        self.RootExportList = ExportMap.Finish()
+        self.ExportList = Util.SortByNameField(ExportMap.Nodes.values())
+
+        # make the frame names unique, in the order of the export list
+        self.FrameNames = FrameNames()
+        for Object in self.ExportList:
+            Object.SafeName = self.FrameNames.Claim(Object.BlenderObject, Object.SafeName)
+        for SafeName, Name in self.FrameNames.Collisions:
+            self.log.log("Frame name {} is used more than once, renamed to {}".format(SafeName, Name), False, True)
+
+        # Number of exported objects using each mesh, and the Mesh bodies of
+        # linked duplicates written so far (see MeshExportObject)
+        self.MeshUsers = Counter(Object.BlenderObject.data for Object in self.ExportList
+                                 if Object.type == 'MESH')
+        self.SharedMeshes = {}
+        self.SharedMeshCount = 0
+        self.SharedMeshSize = 0
         self.log.log("Export list complete.", False, True)
         self.log.log("")
 
@@ -221,59 +222,169 @@ class FSXExporter:
                     self.log.log("Animation found for: " + blenObj.name, True)
                     self.AnimList.append(blenObj.fsx_anim_tag)
             Util.Update_Progress("Progress Animation: ", 1)
-
-            # setup generators and writer
-            AnimationGenerators = self.__GatherAnimationGenerators()
-            self.AnimationWriter = AnimationWriter(self.config,
-                                                   self, AnimationGenerators)
             self.log.log("Animation list complete.", False, True)
             self.log.log("")
 
     def __GatherAnimationGenerators(self):
         Generators = []
+        Sampler = TimelineSampler(self.context.scene)
 
         for Object in self.ExportList:
             if Object.type == 'BONE':
                 Generators.append(BoneAnimationGenerator(self.config,
-                                  None, Object, self.modeldefTree))
+                                  None, Object, self.modeldefTree, Sampler))
             elif (Object.type == 'MESH' or Object.type == 'EMPTY'):
                 Generators.append(GenericAnimationGenerator(self.config,
-                                  None, Object, self.modeldefTree))
+                                  None, Object, self.modeldefTree, Sampler))
+
+        # every generator has asked for its frames; step the timeline once
+        FrameCount, SampleCount = Sampler.Run()
+        self.log.log("Sampled {} matrices over {} frames".format(SampleCount, FrameCount), False, True)
+        for Generator in Generators:
+            Generator.BuildKeys()
 
         return Generators
 
     def Export(self):
+        # Changes made while exporting (frame changes, modifiers switched off
+        # and on) are not changes to the model
+        ChangeTracker.Suspended = True
+        try:
+            # The generators step the timeline to sample the animation
+            if self.config.ExportAnimation:
+                AnimationGenerators = self.__GatherAnimationGenerators()
+                self.AnimationWriter = AnimationWriter(self.config,
+                                                       self, AnimationGenerators)
+            self.__DisableModifiers()
+            Result = self.__Export()
+        finally:
+            self.__RestoreModifiers()
+            self.context.evaluated_depsgraph_get()
+            ChangeTracker.Suspended = False
+        if Result is None:
+            ChangeTracker.Commit(self.config.filepath, self.OptionSignature, self.ChunkKeys)
+        return Result
+
+    # Armature modifiers must not deform meshes whose skin weights are
+    # exported.  They are all switched off before the depsgraph is evaluated,
+    # instead of around each mesh, which would have the depsgraph evaluated
+    # again for every one of them.  DisabledModifiers maps each object to the
+    # names of its modifiers switched off; the skin weights writer still
+    # counts them as enabled.
+    def __DisableModifiers(self):
+        if not (self.config.ApplyModifiers and self.config.ExportSkinWeights):
+            return
+        for Object in self.ExportList:
+            if Object.type == 'MESH':
+                Modifiers = [Modifier for Modifier in Object.BlenderObject.modifiers
+                             if Modifier.type == 'ARMATURE' and Modifier.show_viewport]
+                if Modifiers:
+                    self.DisabledModifiers[Object.BlenderObject] = {Modifier.name for Modifier in Modifiers}
+                    for Modifier in Modifiers:
+                        Modifier.show_viewport = False
+
+    def __RestoreModifiers(self):
+        for BlenderObject, Names in self.DisabledModifiers.items():
+            for Name in Names:
+                BlenderObject.modifiers[Name].show_viewport = True
+        self.DisabledModifiers = {}
+
+    # Adds the mesh instances of collection instances and geometry nodes to
+    # the export, as children of their instancer.  Instances of an object
+    # share its mesh body like linked duplicates do.  Instanced geometry is
+    # only reachable while the depsgraph lists it, so its mesh is extracted
+    # right away, once per distinct geometry.
+    def __GatherInstances(self):
+        Instancers = {Object.BlenderObject: Object for Object in self.ExportList
+                      if Object.type in {'MESH', 'EMPTY'}}
+        InstanceCounts = Counter()
+        GeometryData = {}
+        Skipped = 0
+
+        for Instance in self.Depsgraph.object_instances:
+            if not Instance.is_instance:
+                continue
+            Instancer = Instancers.get(Instance.parent.original)
+            if Instancer is None:
+                continue
+            if Instance.object.type != 'MESH':
+                Skipped += 1
+                continue
+
+            Source = Instance.object.original
+            if Source != Instancer.BlenderObject:
+                Data = None
+                SourceName = Source.name
+                self.MeshUsers[Source.data] += 1
+            else:
+                # Geometry made by the instancer's geometry nodes
+                Mesh = Instance.object.data
+                SourceName = Mesh.name
+                Data = GeometryData.get(Mesh.as_pointer())
+                if Data is None:
+                    Data = MeshExportObject._ExtractTriangulatedMeshData(self.config, Mesh, True)
+                    GeometryData[Mesh.as_pointer()] = Data
+
+            Name = "{}_{}_{}".format(Instancer.name, SourceName, InstanceCounts[Instancer])
+            InstanceCounts[Instancer] += 1
+            Object = InstanceExportObject(self.config, self, Source, Name,
+                                          Instance.matrix_world.copy(), Data)
+            Object.SafeName = self.FrameNames.Claim(Object, Object.SafeName)
+            Object.Parent = Instancer
+            Instancer.Children.append(Object)
+
+        for Instancer in InstanceCounts:
+            Instancer.Children = Util.SortByNameField(Instancer.Children)
+        self.log.log("{} instances of {} instancers added to the export, {} instances that are not meshes skipped".format(
+            sum(InstanceCounts.values()), len(InstanceCounts), Skipped), False, True)
+
+    def __Export(self):
         # set current frame to frame 0 before export
         Scene = bpy.context.scene
         BlenderCurrentFrame = Scene.frame_current
         Scene.frame_set(0)
 
+        # every mesh is taken from this one evaluation of the scene
+        self.Depsgraph = self.context.evaluated_depsgraph_get()
+        if self.config.ExportInstances:
+            self.__GatherInstances()
+
         # open and write data to .x file
         self.File.Open()
+        try:
+            self.log.log("Writing header to X-file", False, True)
+            self.__WriteHeader()
+            self.log.log("Writing GUID to X-file", False, True)
+            self.__WriteGUID()
+            self.log.log("Outlining hierarchy in X-file", False, True)
+            self.__WriteHierarchy()
+            self.log.log()
 
-        self.log.log("Writing header to X-file", False, True)
-        self.__WriteHeader()
-        self.log.log("Writing GUID to X-file", False, True)
-        self.__WriteGUID()
-        self.log.log("Outlining hierarchy in X-file", False, True)
-        self.__WriteHierarchy()
-        self.log.log()
-
-        # Here is where the fun begins.
-        self.log.log("Writing geometry information...", False, True)
-        self.__OpenRootFrame()
-        for idx, Object in enumerate(self.RootExportList):
-            self.log.log("Writing information of %s" % Object.name, True, True)
-            Util.Update_Progress("Progress Geometry: ", idx / len(self.RootExportList))
-            # This one is tricky, due to the changes in Blenders materials:
-            Object.Write()
-        self.__CloseRootFrame()
-        Util.Update_Progress("Progress Geometry: ", 1)
-        self.log.log("Finished writing geometry information. Closing file.", False, True)
-        self.log.log()
-
-        # finishing up...
-        self.File.Close()
+            # Here is where the fun begins.
+            self.log.log("Writing geometry information...", False, True)
+            self.__OpenRootFrame()
+            for idx, Object in enumerate(self.RootExportList):
+                self.log.log("Writing information of %s" % Object.name, True, True)
+                Util.Update_Progress("Progress Geometry: ", idx / len(self.RootExportList))
+                # This one is tricky, due to the changes in Blenders materials:
+                Object.Write()
+            self.__CloseRootFrame()
+            Util.Update_Progress("Progress Geometry: ", 1)
+            self.log.log("Finished writing geometry information. Closing file.", False, True)
+            if self.SharedMeshCount:
+                self.log.log("Linked duplicates: {} mesh bodies reused, {:.1f} KB not evaluated and formatted again".format(
+                    self.SharedMeshCount, self.SharedMeshSize / 1024), False, True)
+            if self.ChunkCache is not None:
+                self.log.log("Chunk cache: {} meshes spliced from the cache, {} formatted".format(
+                    self.ChunkCache.Hits, self.ChunkCache.Misses), False, True)
+            self.log.log()
+
+            # finishing up...
+            self.File.Close()
+        except BaseException:
+            # leave no worker processes behind
+            self.File.Abort()
+            raise
 
         # Write gathered animations to .xanim
         if self.AnimationWriter is not None:
@@ -282,7 +393,10 @@ class FSXExporter:
         # reset current frame
         Scene.frame_set(BlenderCurrentFrame)
         # building .MDL file directly
-        if self.config.ExportMDL:
+        if self.config.ExportMDL and self.Changes is not None and not self.Changes.Changed \
+                and exists(Util.ReplaceFileNameExt(self.config.filepath, '.MDL')):
+            self.log.log("Nothing changed since the last export, the .MDL file is up to date.", False, True)
+        elif self.config.ExportMDL:
             # XToMDL and ModelDef file paths #####
             if (Scene.global_sdk == 'fsx'):
                 XToMdl = ''.join([self.sdkTree, "\\Environment Kit\\Modeling SDK\\3DSM7\\Plugins\\XToMdl.exe"])
@@ -437,7 +551,7 @@ class FSXExporter:
         fw = self.File.Write
 
         # write header + comments
-        self.File.Write("xof 0302txt 0032\n\n")
+        self.File.WriteSignature()
         self.File.Write("// Direct3D .x file translation of context.scene\n")
         self.File.Write("// Generated by Blender %s.%s.%s, Blender2P3D/FSX Version %s\n" % (m, n, k, version))
         self.File.Write("// %.4i-%.2i-%.2i  %.2i:%.2i:%.2i\n\n\n" % (curtime))
@@ -1123,14 +1237,12 @@ Header {
         self.File.Write("//=====================\n// FILE NODE HIERARCHY\n//=====================\n")
         self.File.Write("// Scene_Root\n")
 
-        # recursive function, writes an object and its children
-        def writeobj(obj, level):
+        # writes each object and, below it, its children
+        Stack = [(obj, 1) for obj in reversed(self.RootExportList)]
+        while Stack:
+            obj, level = Stack.pop()
             self.File.Write(("// {}" + obj.SafeName + "\n").format("  " * level))
-            for Child in Util.SortByNameField(obj.Children):
-                writeobj(Child, level + 1)
-
-        for obj in self.RootExportList:
-            writeobj(obj, 1)
+            Stack.extend((Child, level + 1) for Child in reversed(obj.Children))
         self.File.Write("\n")
 
     # open the root frame with master conversion and scale
@@ -1175,6 +1287,11 @@ Header {
 
 # Writes all animation data to file.
 class AnimationWriter:
+    # Indentation of each level of the .xanim, and the lines of a key
+    Indentation = ["  " * Level for Level in range(4)]
+    RotationKeyLine = Indentation[3] + '<Keyframe time="%8f" data="%8f;%8f;%8f;%8f" type="Quaternion" />\n'
+    PositionKeyLine = Indentation[3] + '<Keyframe time="%8f" data="%8f;%8f;%8f;0.0" type="Vector" />\n'
+
     def __init__(self, config, Exporter, AnimationGenerators):
         self.config = config
         self.Exporter = Exporter
@@ -1184,73 +1301,100 @@ class AnimationWriter:
 
     # Writes all AnimationSets.  Implementations probably won't have to override
     # this method.
+    #
+    # The animations are grouped by tag in one pass over the generators and
+    # the modeldef attributes of each tag are looked up in a dict.  The
+    # AnimLib XML is written to the file as it goes, one stream at a time,
+    # in the layout ElementTree would give it, so no tree of Keyframe
+    # elements is ever built.
     def WriteAnimations(self, modeldefTree):
         self.Exporter.log.log("Writing animation data to .xanim...", False, True)
 
-        sourceroot = modeldefTree.getroot()
-        root = etree.Element('AnimLib')
-        root.set("version", "9.1")
-        tree = etree.ElementTree(root)
-        # Write each animation of each generator
-        for anim in self.Exporter.AnimList:
-            element = sourceroot.find(".Animation[@name='%s']" % (anim))
-            self.Exporter.log.log(" Start writing Animation data for %s" % anim, False, False)
-            anim_tag = etree.SubElement(root, "Anim", element.attrib)
-
-            for Generator in self.AnimationGenerators:
-                for CurrentAnimation in Generator.Animations:
-                    if CurrentAnimation.AnimTag == anim:
-                        try:
-                            if not anim_tag.attrib['length']:
-                                pass
-                        except KeyError:
-                            anim_tag.set("length", "{:8f}" .format(CurrentAnimation.KeyRange))
-                        # write rotation keys
-                        self.Exporter.log.log(" * Animation data for %s" % CurrentAnimation.SafeName, False, False)
-                        anim_stream = etree.SubElement(anim_tag, "AnimStream")
-                        anim_stream.set("name", "Rotation")
-                        anim_stream.set("id", "0")
-                        anim_stream.set("partName", CurrentAnimation.SafeName)
-                        anim_stream.set("length", "{:8f}" .format(CurrentAnimation.KeyRange))
-                        for Frame in sorted(CurrentAnimation.RotationKeys.keys()):
-                            rot = CurrentAnimation.RotationKeys[Frame]
-                            keyframe = etree.SubElement(anim_stream, "Keyframe")
-                            keyframe.set("time", "{:8f}" .format(int(Frame)))
-                            keyframe.set("data", "{:8f};{:8f};{:8f};{:8f}" .format(-rot[1], -rot[2], -rot[3], rot[0]))
-                            keyframe.set("type", "Quaternion")
-
-                        # write position keys
-                        anim_stream = etree.SubElement(anim_tag, "AnimStream")
-                        anim_stream.set("name", "Location")
-                        anim_stream.set("id", "2")
-                        anim_stream.set("partName", CurrentAnimation.SafeName)
-                        anim_stream.set("length", "{:8f}" .format(CurrentAnimation.KeyRange))
-                        for Frame in sorted(CurrentAnimation.PositionKeys.keys()):
-                            loc = CurrentAnimation.PositionKeys[Frame]
-                            keyframe = etree.SubElement(anim_stream, "Keyframe")
-                            keyframe.set("time", "{:8f}" .format(int(Frame)))
-                            keyframe.set("data", "{:8f};{:8f};{:8f};0.0" .format(loc[0], loc[1], loc[2]))
-                            keyframe.set("type", "Vector")
-
-        # in-place prettyprint formatter
-        def indent(elem, level=0):
-            i = "\n" + level*"  "
-            if len(elem):
-                if not elem.text or not elem.text.strip():
-                    elem.text = i + "  "
-                if not elem.tail or not elem.tail.strip():
-                    elem.tail = i
-                for elem in elem:
-                    indent(elem, level + 1)
-                if not elem.tail or not elem.tail.strip():
-                    elem.tail = i
-            else:
-                if level and (not elem.tail or not elem.tail.strip()):
-                    elem.tail = i
-        # write to file
-        indent(root)
+        # the first Animation element of each name, as find() would return
+        Definitions = {}
+        for Element in modeldefTree.getroot().iterfind("Animation"):
+            Definitions.setdefault(Element.get("name"), Element.attrib)
+
+        AnimationsByTag = {}
+        for Generator in self.AnimationGenerators:
+            for CurrentAnimation in Generator.Animations:
+                AnimationsByTag.setdefault(CurrentAnimation.AnimTag, []).append(CurrentAnimation)
+
         xanimpath = Util.ReplaceFileNameExt(self.config.filepath, ".xanim")
-        tree.write(xanimpath, encoding="ISO-8859-1")
+        with open(xanimpath, "w", encoding="ISO-8859-1", errors="xmlcharrefreplace") as xanim:
+            xanim.write("<?xml version='1.0' encoding='ISO-8859-1'?>\n")
+            if not self.Exporter.AnimList:
+                xanim.write('<AnimLib version="9.1" />')
+            else:
+                xanim.write('<AnimLib version="9.1">\n')
+                for anim in self.Exporter.AnimList:
+                    if anim not in Definitions:
+                        raise ExportError("Animation {} is not defined in the modeldef".format(anim))
+                    self.__WriteAnim(xanim, anim, Definitions[anim], AnimationsByTag.get(anim, []))
+                xanim.write("</AnimLib>\n")
 
         self.Exporter.log.log("Animation file complete.", False, True)
         self.Exporter.log.log()
+
+    # "Private" Methods
+
+    # Reduces the keys of an animation and logs how many of each stream are
+    # left
+    def __ReduceKeys(self, CurrentAnimation):
+        RotationCount, PositionCount = CurrentAnimation.Reduce(self.config.KeyframePositionTolerance,
+                                                               self.config.KeyframeRotationTolerance)
+        for Stream, Before, After in (("Rotation", RotationCount, len(CurrentAnimation.RotationFrames)),
+                                      ("Location", PositionCount, len(CurrentAnimation.PositionFrames))):
+            self.Exporter.log.log("   {} keys: {} of {} kept ({:.0%})".format(
+                Stream, After, Before, After / Before if Before else 1.0), False, False)
+
+    # Writes the Anim element of one tag with the streams of its animations
+    def __WriteAnim(self, xanim, anim, Definition, Animations):
+        self.Exporter.log.log(" Start writing Animation data for %s" % anim, False, False)
+        Attributes = dict(Definition)
+        if Animations and "length" not in Attributes:
+            Attributes["length"] = "{:8f}".format(Animations[0].KeyRange)
+
+        Indentation = AnimationWriter.Indentation
+        if not Animations:
+            xanim.write("{}<Anim{} />\n".format(Indentation[1], self.__Attributes(Attributes)))
+            return
+        xanim.write("{}<Anim{}>\n".format(Indentation[1], self.__Attributes(Attributes)))
+
+        for CurrentAnimation in Animations:
+            self.Exporter.log.log(" * Animation data for %s" % CurrentAnimation.SafeName, False, False)
+            if self.config.ReduceKeyframes:
+                self.__ReduceKeys(CurrentAnimation)
+            StreamAttributes = {"partName": CurrentAnimation.SafeName,
+                                "length": "{:8f}".format(CurrentAnimation.KeyRange)}
+
+            # write rotation keys; the .xanim wants (-x, -y, -z, w)
+            Rotations = CurrentAnimation.Rotations[:, [1, 2, 3, 0]] * [-1.0, -1.0, -1.0, 1.0]
+            self.__WriteStream(xanim, dict(name="Rotation", id="0", **StreamAttributes),
+                               AnimationWriter.RotationKeyLine, CurrentAnimation.RotationFrames, Rotations)
+
+            # write position keys
+            self.__WriteStream(xanim, dict(name="Location", id="2", **StreamAttributes),
+                               AnimationWriter.PositionKeyLine, CurrentAnimation.PositionFrames,
+                               CurrentAnimation.Positions)
+
+        xanim.write("{}</Anim>\n".format(Indentation[1]))
+
+    def __WriteStream(self, xanim, Attributes, KeyLine, Frames, Values):
+        Indentation = AnimationWriter.Indentation
+        if not len(Frames):
+            xanim.write("{}<AnimStream{} />\n".format(Indentation[2], self.__Attributes(Attributes)))
+            return
+        xanim.write("{}<AnimStream{}>\n".format(Indentation[2], self.__Attributes(Attributes)))
+        xanim.write("".join([KeyLine % (Frame, *Row) for Frame, Row in zip(Frames.tolist(), Values.tolist())]))
+        xanim.write("{}</AnimStream>\n".format(Indentation[2]))
+
+    # XML attributes, escaped as ElementTree escapes them
+    @staticmethod
+    def __Attributes(Attributes):
+        def Escape(Text):
+            for Char, Entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;"), ("\"", "&quot;"),
+                                 ("\r", "&#13;"), ("\n", "&#10;"), ("\t", "&#09;")):
+                Text = Text.replace(Char, Entity)
+            return Text
+        return "".join(' {}="{}"'.format(Name, Escape(Value)) for Name, Value in Attributes.items())
@@ -94,89 +94,26 @@ class FSXMatExporter:
 
         # ExportMap maps Blender objects to ExportObjects
         self.log.log("Gathering mesh objects from scene...", False, True)
-        ExportMap = {}
+        ExportMap = SceneGraph()
         for idx, Object in enumerate(self.context.scene.objects):
             Util.Update_Progress("Progress: ", idx / len(self.context.scene.objects))
 
             if Object.type == 'MESH':
                 self.log.log("object found: %s [MESH]"%Object.name, True)
-                ExportMap[Object] = MeshExportObject(self.config, self, Object)
+                ExportMap.Add(Object, MeshExportObject(self.config, self, Object))
         Util.Update_Progress("Progress: ", 1)
         self.log.log("All mesh objects from scene gathered.", False, True)
         self.log.log("")
 
+        # only meshes are gathered, so every object is a root and an object
+        # that is not selected is simply dropped
         if self.config.ExportSelection:
             self.log.log("Removing un-selected objects from export list", False, True)
-            # first, find all roots among exportable types
-            RootList = [obj.BlenderObject for obj in ExportMap.values()
-                        if obj.BlenderObject.parent is None]
-            NoExportList = []
+            ExportMap.Prune(lambda Object, ExportObject: Object.select_get())
 
-            # recursive function, updates child-parent relation to fit selection
-            def swapparent(obj, NoExportList):
-                if type(obj) == bpy_types_Bone:
-                    BoneObj = ExportMap[obj]
-                    Arm = BoneObj.ParentArmature
-                    if Arm.select_get():
-                        return
-                    else:
-                        NoExportList.append(obj)
-                        for child in obj.children:
-                            swapparent(child, NoExportList)
-                        return
-
-                if not obj.select_get():
-                    NoExportList.append(obj)
-                    if ExportMap[obj].Parent:
-                        if ExportMap[obj] in ExportMap[obj].Parent.Children:
-                            ExportMap[obj].Parent.Children.remove(ExportMap[obj])
-                    for child in obj.children:
-                        if not ExportMap[obj].Parent:
-                            ExportMap[child].Parent = None
-                        else:
-                            ExportMap[child].Parent = ExportMap[obj].Parent
-                            if ExportMap[child] not in ExportMap[obj].Parent.Children:
-                                ExportMap[obj].Parent.Children.append(ExportMap[child])
-                        swapparent(child, NoExportList)
-                else:
-                    for child in obj.children:
-                        swapparent(child, NoExportList)
-
-            # update children and parents
-            for ob in RootList:
-                swapparent(ob, NoExportList)
-
-            # remove objects that are not selected
-            for ob in NoExportList:
-                ExportMap.pop(ob)
-
-            del RootList
-            del NoExportList
-
-        # exclude all armatures from export
-        ArmList = []
-        for ob in ExportMap.values():
-            if ob.type == 'ARMATURE':
-                arm = ob.BlenderObject
-                ArmList.append(arm)
-                if ob.Parent:
-                    ob.Parent.Children.remove(ob)
-                for child in arm.children:
-                    if ob.Parent:
-                        ExportMap[child].Parent = ExportMap[arm.parent]
-                        ExportMap[arm.parent].Children.append(ExportMap[child])
-                    else:
-                        ExportMap[child].Parent = None
-        for arm in ArmList:
-            ExportMap.pop(arm)
-
-        # list root level objects to be exported
-        self.RootExportList = [Object for Object in ExportMap.values()
-                               if Object.Parent is None]
-
-        # tidying up...
-        self.RootExportList = Util.SortByNameField(self.RootExportList)
-        self.ExportList = Util.SortByNameField(ExportMap.values())
+        # list root level objects to be exported, everything sorted by name
+        self.RootExportList = ExportMap.Finish()
+        self.ExportList = Util.SortByNameField(ExportMap.Nodes.values())
         self.log.log("Export list complete.", False, True)
         self.log.log("")
 
@@ -0,0 +1,197 @@
+#####################################################################################
+#
+#  Blender2P3D/FSX
+#
+#####################################################################################
+#
+# The addon in its current version is the hard work of many members of the
+# fsdeveloper.com forum. The original FSX2Blender addon was developed by:
+#   Felix Owono-Ateba
+#   Ron Haertel
+#   Kris Pyatt (2017)
+#   Manochvarma Raman (2018)
+#
+# This current incarnation of the addon uses most of the original algorithms,
+# but with an updated UI and compatibility for Blender 2.8x. Parts of the
+# original exporter script have been re-written to accommodate Blender's new
+# material workflow and to add PBR support to the addon (P3D v4.4+/v5 only).
+#
+# The conversion for Blender 2.8x was done by:
+#   Otmar Nitsche (2019/2020)
+#
+# Further enhancement to the material workflow were coded by:
+#   David Hoeffgen (2020)
+#
+# For information on how to use the addon, please visit:
+# https://www.fsdeveloper.com/wiki/index.php?title=Blender2P3D/FSX
+#
+# If you have any questions, or suggestions, visit the support thread under:
+# https://www.fsdeveloper.com/forum/forums/blender.136/
+#
+# For the original Blender2FSX addon, visit:
+# https://www.fsdeveloper.com/forum/threads/blender2fsx-p3d-v0-9-5-onwards.442082/
+#
+# Special thanks go to Arno Gerretsen and Bill Womack for their input during the
+# development and testing of the addon.
+#
+# The software is licensed under GNU General Public License (GNU-GPL-3).
+# Feel free to use it as you see fit, both for freeware and commercial projects.
+# If you have suggestions for changes, use the support thread in the
+# fsdeveloper.com forum. If you would like to get involved in the development
+# of the addon, contact any of the authors mentioned above to coordinate
+# the effort.
+#
+#####################################################################################
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#####################################################################################
+
+import bpy
+from mathutils import Euler, Matrix, Quaternion, Vector
+
+
+# Transform properties an F-Curve may animate, with their size
+_TransformPaths = {"location": 3, "rotation_euler": 3, "rotation_quaternion": 4,
+                   "rotation_axis_angle": 4, "scale": 3, "delta_location": 3,
+                   "delta_rotation_euler": 3, "delta_rotation_quaternion": 4, "delta_scale": 3}
+
+
+# Rebuilds the transform of an object or a pose bone straight from the
+# F-Curves of its action, without setting the scene frame.  Channels without
+# an F-Curve keep their current value.  The transform is built the way
+# Blender builds it: location, then rotation (in the rotation mode of the
+# owner), then scale, with the delta transforms of objects applied on top.
+#
+# Use ForObject() and ForPoseBone(), which only hand out an FCurveTransform
+# when nothing but the action moves the owner, and when the transform built
+# from the current values matches the one Blender reports (which rules out
+# cases not handled here, such as an unusual parenting).  Both return the
+# transform (or None) and a short description of the path taken, for the
+# log.
+class FCurveTransform:
+    # Matrices built here and the ones Blender reports may differ this much
+    Tolerance = 1e-5
+
+    def __init__(self, Owner, Action, Prefix, Deltas):
+        self.Owner = Owner
+        self.__Deltas = Deltas
+        self.__Values = {}
+        self.__FCurves = {}
+        for Path, Size in _TransformPaths.items():
+            if not Deltas and Path.startswith("delta_"):
+                continue
+            self.__Values[Path] = tuple(getattr(Owner, Path))
+        for FCurve in Action.fcurves:
+            if FCurve.data_path.startswith(Prefix):
+                Path = FCurve.data_path[len(Prefix):]
+                if Path in self.__Values and not FCurve.mute:
+                    self.__FCurves[Path, FCurve.array_index] = FCurve
+
+    def __repr__(self):
+        return "[FCurveTransform: {}]".format(self.Owner.name)
+
+    # "Public" Interface
+
+    @staticmethod
+    def ForObject(Object):
+        if Object.constraints:
+            return None, "sampled (constraints)"
+        if Object.parent is not None and Object.parent_type != 'OBJECT':
+            return None, "sampled ({} parent)".format(Object.parent_type.lower())
+        Reason = FCurveTransform.__AnimationReason(Object.animation_data, "")
+        if Reason:
+            return None, Reason
+
+        Transform = FCurveTransform(Object, Object.animation_data.action, "", True)
+        if not FCurveTransform.__Matches(Transform.MatrixLocal(), Object.matrix_local):
+            return None, "sampled (transform not reproduced)"
+        return Transform, "F-Curves"
+
+    @staticmethod
+    def ForPoseBone(ArmatureObject, PoseBone):
+        if PoseBone.constraints:
+            return None, "sampled (constraints)"
+        Prefix = 'pose.bones["{}"].'.format(bpy.utils.escape_identifier(PoseBone.name))
+        Reason = FCurveTransform.__AnimationReason(ArmatureObject.animation_data, Prefix)
+        if Reason:
+            return None, Reason
+
+        Transform = FCurveTransform(PoseBone, ArmatureObject.animation_data.action, Prefix, False)
+        if not FCurveTransform.__Matches(Transform.MatrixBasis(), PoseBone.matrix_basis):
+            return None, "sampled (transform not reproduced)"
+        return Transform, "F-Curves"
+
+    # Location, rotation and scale (and deltas) at Frame, or as they are now
+    # when Frame is None
+    def MatrixBasis(self, Frame=None):
+        Scale = Vector(self.__Channels("scale", Frame))
+        Rotation = self.__Rotation("", Frame)
+        Location = Vector(self.__Channels("location", Frame))
+        if self.__Deltas:
+            Scale *= Vector(self.__Channels("delta_scale", Frame))
+            Rotation = self.__Rotation("delta_", Frame) @ Rotation
+            Location += Vector(self.__Channels("delta_location", Frame))
+
+        Matrix_basis = (Rotation @ Matrix.Diagonal(Scale)).to_4x4()
+        Matrix_basis.translation = Location
+        return Matrix_basis
+
+    # The transform relative to the parent, as Object.matrix_local
+    def MatrixLocal(self, Frame=None):
+        if self.Owner.parent is None:
+            return self.MatrixBasis(Frame)
+        return self.Owner.matrix_parent_inverse @ self.MatrixBasis(Frame)
+
+    # "Private" Methods
+
+    def __Channels(self, Path, Frame):
+        if Frame is None:
+            return list(self.__Values[Path])
+        return [self.__FCurves[Path, Index].evaluate(Frame) if (Path, Index) in self.__FCurves else Value
+                for Index, Value in enumerate(self.__Values[Path])]
+
+    # Rotation part of the transform, as a 3x3 matrix.  Objects have no
+    # delta rotation in axis angle mode.
+    def __Rotation(self, Delta, Frame):
+        Mode = self.Owner.rotation_mode
+        if Mode == 'QUATERNION':
+            return Quaternion(self.__Channels(Delta + "rotation_quaternion", Frame)).normalized().to_matrix()
+        if Mode == 'AXIS_ANGLE':
+            if Delta:
+                return Matrix.Identity(3)
+            Angle, X, Y, Z = self.__Channels("rotation_axis_angle", Frame)
+            return Matrix.Rotation(Angle, 3, Vector((X, Y, Z)).normalized())
+        return Euler(self.__Channels(Delta + "rotation_euler", Frame), Mode).to_matrix()
+
+    # Why the animation data of an owner cannot be evaluated directly, if it
+    # cannot: only a plain action, with no NLA and no drivers on the
+    # transform of the owner, can.
+    @staticmethod
+    def __AnimationReason(AnimData, Prefix):
+        if AnimData is None or AnimData.action is None:
+            return "sampled (no action)"
+        if any(not Track.mute for Track in AnimData.nla_tracks):
+            return "sampled (NLA tracks)"
+        if AnimData.action_blend_type != 'REPLACE' or AnimData.action_influence != 1.0:
+            return "sampled (action blending)"
+        for Driver in AnimData.drivers:
+            if Driver.data_path.startswith(Prefix) and Driver.data_path[len(Prefix):] in _TransformPaths:
+                return "sampled (drivers)"
+        return ""
+
+    @staticmethod
+    def __Matches(A, B):
+        return all(abs(a - b) <= FCurveTransform.Tolerance
+                   for RowA, RowB in zip(A, B) for a, b in zip(RowA, RowB))
@@ -0,0 +1,151 @@
+#####################################################################################
+#
+#  Blender2P3D/FSX
+#
+#####################################################################################
+#
+# The addon in its current version is the hard work of many members of the
+# fsdeveloper.com forum. The original FSX2Blender addon was developed by:
+#   Felix Owono-Ateba
+#   Ron Haertel
+#   Kris Pyatt (2017)
+#   Manochvarma Raman (2018)
+#
+# This current incarnation of the addon uses most of the original algorithms,
+# but with an updated UI and compatibility for Blender 2.8x. Parts of the
+# original exporter script have been re-written to accommodate Blender's new
+# material workflow and to add PBR support to the addon (P3D v4.4+/v5 only).
+#
+# The conversion for Blender 2.8x was done by:
+#   Otmar Nitsche (2019/2020)
+#
+# Further enhancement to the material workflow were coded by:
+#   David Hoeffgen (2020)
+#
+# For information on how to use the addon, please visit:
+# https://www.fsdeveloper.com/wiki/index.php?title=Blender2P3D/FSX
+#
+# If you have any questions, or suggestions, visit the support thread under:
+# https://www.fsdeveloper.com/forum/forums/blender.136/
+#
+# For the original Blender2FSX addon, visit:
+# https://www.fsdeveloper.com/forum/threads/blender2fsx-p3d-v0-9-5-onwards.442082/
+#
+# Special thanks go to Arno Gerretsen and Bill Womack for their input during the
+# development and testing of the addon.
+#
+# The software is licensed under GNU General Public License (GNU-GPL-3).
+# Feel free to use it as you see fit, both for freeware and commercial projects.
+# If you have suggestions for changes, use the support thread in the
+# fsdeveloper.com forum. If you would like to get involved in the development
+# of the addon, contact any of the authors mentioned above to coordinate
+# the effort.
+#
+#####################################################################################
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#####################################################################################
+
+import numpy as np
+
+
+# Array math on animation keys.  Quaternions are rows of (w, x, y, z), the
+# order mathutils uses, and every function works on all the rows at once;
+# a single quaternion broadcasts against a whole stream.
+
+
+def QuaternionConjugate(Q):
+    return np.asarray(Q) * np.array([1.0, -1.0, -1.0, -1.0])
+
+
+# Hamilton product A * B, row by row
+def QuaternionMultiply(A, B):
+    A = np.asarray(A)
+    B = np.asarray(B)
+    Aw, Ax, Ay, Az = A[..., 0], A[..., 1], A[..., 2], A[..., 3]
+    Bw, Bx, By, Bz = B[..., 0], B[..., 1], B[..., 2], B[..., 3]
+    return np.stack([Aw * Bw - Ax * Bx - Ay * By - Az * Bz,
+                     Aw * Bx + Ax * Bw + Ay * Bz - Az * By,
+                     Aw * By - Ax * Bz + Ay * Bw + Az * Bx,
+                     Aw * Bz + Ax * By - Ay * Bx + Az * Bw], axis=-1)
+
+
+# The rotation from A to B, as mathutils' A.rotation_difference(B)
+def QuaternionDifference(A, B):
+    A = np.asarray(A)
+    Inverse = QuaternionConjugate(A) / np.sum(A * A, axis=-1, keepdims=True)
+    return QuaternionMultiply(Inverse, B)
+
+
+# Flips the sign of the quaternions that point away from the one before, so
+# consecutive keys always lie in the same hemisphere and interpolating
+# between them takes the short way round.  Q and -Q are the same rotation.
+def MakeContinuous(Q):
+    Q = np.array(Q, dtype=np.float64)
+    if len(Q) > 1:
+        Flips = np.einsum("ij,ij->i", Q[1:], Q[:-1]) < 0.0
+        Signs = np.cumprod(np.where(Flips, -1.0, 1.0))
+        Q[1:] *= Signs[:, np.newaxis]
+    return Q
+
+
+# Angle between the rotations A and B
+def QuaternionAngle(A, B):
+    Dot = np.abs(np.sum(np.asarray(A) * np.asarray(B), axis=-1))
+    return 2.0 * np.arccos(np.minimum(Dot, 1.0))
+
+
+# Spherical interpolation from A to B (single quaternions) at each of T,
+# the short way round
+def Slerp(A, B, T):
+    Dot = float(np.dot(A, B))
+    if Dot < 0.0:
+        B, Dot = -B, -Dot
+    T = np.asarray(T)[:, np.newaxis]
+    if Dot > 0.9995:
+        Q = A + (B - A) * T
+        return Q / np.linalg.norm(Q, axis=1, keepdims=True)
+    Theta = np.arccos(Dot)
+    return (np.sin((1.0 - T) * Theta) * A + np.sin(T * Theta) * B) / np.sin(Theta)
+
+
+def Lerp(A, B, T):
+    return A + (B - A) * np.asarray(T)[:, np.newaxis]
+
+
+def Distance(A, B):
+    return np.linalg.norm(np.asarray(A) - np.asarray(B), axis=-1)
+
+
+# Greedy reduction of one stream of keys: Frames is sorted, Values has one
+# row per frame.  A key is kept only where interpolating from the last kept
+# key to the next key would move one of the keys in between by more than
+# Tolerance.  The first and last key are always kept.  Returns the indexes
+# of the keys kept.
+def ReduceKeys(Frames, Values, Interpolate, Measure, Tolerance):
+    if len(Frames) < 3:
+        return np.arange(len(Frames))
+
+    Frames = np.asarray(Frames, dtype=np.float64)
+    Kept = [0]
+    Anchor = 0
+    for End in range(2, len(Frames)):
+        Between = slice(Anchor + 1, End)
+        T = (Frames[Between] - Frames[Anchor]) / (Frames[End] - Frames[Anchor])
+        if (Measure(Interpolate(Values[Anchor], Values[End], T), Values[Between]) > Tolerance).any():
+            Anchor = End - 1
+            Kept.append(Anchor)
+    Kept.append(len(Frames) - 1)
+    return np.array(Kept)
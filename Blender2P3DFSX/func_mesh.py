@@ -0,0 +1,345 @@
+#####################################################################################
+#
+#  Blender2P3D/FSX
+#
+#####################################################################################
+#
+# The addon in its current version is the hard work of many members of the
+# fsdeveloper.com forum. The original FSX2Blender addon was developed by:
+#   Felix Owono-Ateba
+#   Ron Haertel
+#   Kris Pyatt (2017)
+#   Manochvarma Raman (2018)
+#
+# This current incarnation of the addon uses most of the original algorithms,
+# but with an updated UI and compatibility for Blender 2.8x. Parts of the
+# original exporter script have been re-written to accommodate Blender's new
+# material workflow and to add PBR support to the addon (P3D v4.4+/v5 only).
+#
+# The conversion for Blender 2.8x was done by:
+#   Otmar Nitsche (2019/2020)
+#
+# Further enhancement to the material workflow were coded by:
+#   David Hoeffgen (2020)
+#
+# For information on how to use the addon, please visit:
+# https://www.fsdeveloper.com/wiki/index.php?title=Blender2P3D/FSX
+#
+# If you have any questions, or suggestions, visit the support thread under:
+# https://www.fsdeveloper.com/forum/forums/blender.136/
+#
+# For the original Blender2FSX addon, visit:
+# https://www.fsdeveloper.com/forum/threads/blender2fsx-p3d-v0-9-5-onwards.442082/
+#
+# Special thanks go to Arno Gerretsen and Bill Womack for their input during the
+# development and testing of the addon.
+#
+# The software is licensed under GNU General Public License (GNU-GPL-3).
+# Feel free to use it as you see fit, both for freeware and commercial projects.
+# If you have suggestions for changes, use the support thread in the
+# fsdeveloper.com forum. If you would like to get involved in the development
+# of the addon, contact any of the authors mentioned above to coordinate
+# the effort.
+#
+#####################################################################################
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#####################################################################################
+
+import hashlib
+import numpy as np
+
+
+# Bulk copy of one attribute of a Blender collection into a flat NumPy array.
+# foreach_get fills the whole array in a single call, which is orders of
+# magnitude faster than visiting each element from Python.
+def _ForeachGet(Collection, Attribute, Count, Width=1, DataType=np.float32):
+    Array = np.empty(Count * Width, dtype=DataType)
+    if Count:
+        Collection.foreach_get(Attribute, Array)
+    if Width > 1:
+        Array.shape = (Count, Width)
+    return Array
+
+
+# True when every polygon of Mesh is already a triangle.
+def IsTriangulated(Mesh):
+    PolygonCount = len(Mesh.polygons)
+    return bool((_ForeachGet(Mesh.polygons, "loop_total", PolygonCount, DataType=np.int32) == 3).all())
+
+
+# Snapshot of everything the .x writers need from an evaluated mesh.  The
+# data is extracted once, one foreach_get pass per attribute, and the writers
+# only ever read these arrays.  Nothing in here touches the per-element
+# MeshVertex/MeshPolygon/MeshLoop proxies again after extraction, except for
+# the vertex group weights, which Blender does not expose to foreach_get.
+class MeshData:
+    def __init__(self, Mesh, SkinWeights=False, Triangulate=False):
+        self.name = Mesh.name
+
+        VertexCount = len(Mesh.vertices)
+        LoopCount = len(Mesh.loops)
+        PolygonCount = len(Mesh.polygons)
+
+        # Per vertex
+        self.Positions = _ForeachGet(Mesh.vertices, "co", VertexCount, 3)
+        self.VertexNormals = _ForeachGet(Mesh.vertices, "normal", VertexCount, 3)
+
+        # Per loop (face corner)
+        self.LoopVertexIndexes = _ForeachGet(Mesh.loops, "vertex_index", LoopCount, DataType=np.int32)
+        self.UVLayers = [_ForeachGet(Layer.data, "uv", LoopCount, 2)
+                         for Layer in Mesh.uv_layers]
+
+        # Per polygon
+        self.PolygonLoopStarts = _ForeachGet(Mesh.polygons, "loop_start", PolygonCount, DataType=np.int32)
+        self.PolygonLoopTotals = _ForeachGet(Mesh.polygons, "loop_total", PolygonCount, DataType=np.int32)
+        self.PolygonMaterialIndexes = _ForeachGet(Mesh.polygons, "material_index", PolygonCount, DataType=np.int32)
+        self.PolygonSmooth = _ForeachGet(Mesh.polygons, "use_smooth", PolygonCount, DataType=bool)
+        self.PolygonNormals = _ForeachGet(Mesh.polygons, "normal", PolygonCount, 3)
+
+        # Loop index of every face corner, polygon by polygon.  Blender keeps
+        # the loops of a polygon contiguous, so this is built in one go from
+        # the loop starts instead of walking the polygons.
+        Offsets = np.cumsum(self.PolygonLoopTotals, dtype=np.int64) - self.PolygonLoopTotals
+        self.CornerLoops = np.arange(int(self.PolygonLoopTotals.sum()), dtype=np.int64) + \
+            np.repeat(self.PolygonLoopStarts - Offsets, self.PolygonLoopTotals)
+
+        # Replace the polygons with the triangles Blender tessellates them
+        # into, unless they are all triangles already.
+        if Triangulate and (self.PolygonLoopTotals != 3).any():
+            self.__Triangulate(Mesh)
+
+        # Material slots, not per element data
+        self.Materials = list(Mesh.materials)
+
+        # Vertex group weights in compressed rows: the groups of vertex v are
+        # SkinGroups[SkinOffsets[v]:SkinOffsets[v + 1]].
+        self.SkinOffsets = None
+        self.SkinGroups = None
+        self.SkinWeights = None
+        if SkinWeights:
+            self.__ExtractSkinWeights(Mesh)
+
+    def __repr__(self):
+        return "[MeshData: {}]".format(self.name)
+
+    @property
+    def VertexCount(self):
+        return len(self.Positions)
+
+    @property
+    def LoopCount(self):
+        return len(self.LoopVertexIndexes)
+
+    @property
+    def PolygonCount(self):
+        return len(self.PolygonLoopTotals)
+
+    # Hash of every extracted array, shapes and types included, as a hex
+    # string.  Two snapshots with the same digest write the same mesh.
+    def Digest(self):
+        Hash = hashlib.blake2b(digest_size=20)
+        Arrays = [self.Positions, self.VertexNormals, self.LoopVertexIndexes,
+                  self.PolygonLoopStarts, self.PolygonLoopTotals, self.PolygonMaterialIndexes,
+                  self.PolygonSmooth, self.PolygonNormals, self.CornerLoops] + self.UVLayers
+        if self.SkinOffsets is not None:
+            Arrays += [self.SkinOffsets, self.SkinGroups, self.SkinWeights]
+        Hash.update(repr([(Array.dtype.str, Array.shape) for Array in Arrays]).encode("ascii"))
+        for Array in Arrays:
+            Hash.update(np.ascontiguousarray(Array).data)
+        return Hash.hexdigest()
+
+    # Turns the per polygon arrays into per triangle arrays using
+    # Mesh.loop_triangles, which Blender keeps for drawing anyway, so the mesh
+    # itself is left untouched.  Triangles keep the winding of their polygon
+    # and inherit its material and shading; flat shaded ones get their own
+    # normal, as a triangulated mesh would.  The loops of a triangle are not
+    # contiguous, so CornerLoops is read straight from the triangles and
+    # PolygonLoopStarts holds the loop of each first corner.
+    def __Triangulate(self, Mesh):
+        if hasattr(Mesh, "calc_loop_triangles"):
+            Mesh.calc_loop_triangles()
+        Triangles = Mesh.loop_triangles
+        TriangleCount = len(Triangles)
+
+        self.CornerLoops = _ForeachGet(Triangles, "loops", TriangleCount * 3, DataType=np.int32).astype(np.int64)
+
+        # loop_triangle_polygons only exists from Blender 3.6 on
+        if hasattr(Mesh, "loop_triangle_polygons"):
+            Polygons = _ForeachGet(Mesh.loop_triangle_polygons, "value", TriangleCount, DataType=np.int32)
+        else:
+            Polygons = _ForeachGet(Triangles, "polygon_index", TriangleCount, DataType=np.int32)
+
+        self.PolygonLoopStarts = self.CornerLoops[0::3].astype(np.int32)
+        self.PolygonLoopTotals = np.full(TriangleCount, 3, dtype=np.int32)
+        self.PolygonMaterialIndexes = self.PolygonMaterialIndexes[Polygons]
+        self.PolygonSmooth = self.PolygonSmooth[Polygons]
+        self.PolygonNormals = _ForeachGet(Triangles, "normal", TriangleCount, 3)
+
+    def __ExtractSkinWeights(self, Mesh):
+        VertexGroups = [Vertex.groups for Vertex in Mesh.vertices]
+        Counts = np.fromiter((len(Groups) for Groups in VertexGroups),
+                             dtype=np.int32, count=len(VertexGroups))
+
+        self.SkinOffsets = np.zeros(len(VertexGroups) + 1, dtype=np.int64)
+        np.cumsum(Counts, out=self.SkinOffsets[1:])
+
+        Total = int(self.SkinOffsets[-1])
+        self.SkinGroups = np.fromiter((Element.group for Groups in VertexGroups
+                                       for Element in Groups), dtype=np.int32, count=Total)
+        self.SkinWeights = np.fromiter((Element.weight for Groups in VertexGroups
+                                        for Element in Groups), dtype=np.float32, count=Total)
+
+    # The bone influences of every vertex, for all vertices at once.
+    # GroupBones maps a vertex group index to the index of its bone, or -1
+    # for groups that are not bones.  Influences lighter than Threshold are
+    # dropped, then argpartition picks the MaximumInfluences heaviest of each
+    # vertex, and the kept weights are normalized to sum to 1.  Returns the
+    # influence count of each vertex and VertexCount x k arrays of bones and
+    # weights, padded with -1 and 0; the kept influences stay in vertex group
+    # order.
+    def SkinInfluences(self, GroupBones, MaximumInfluences=4, Threshold=0.0):
+        VertexCount = len(self.SkinOffsets) - 1
+        GroupBones = np.asarray(GroupBones, dtype=np.int32)
+
+        # Bone influences in compressed rows, one row per vertex
+        Groups = self.SkinGroups
+        Bones = np.full(len(Groups), -1, dtype=np.int32)
+        Known = (Groups >= 0) & (Groups < len(GroupBones))
+        Bones[Known] = GroupBones[Groups[Known]]
+        Weights = self.SkinWeights.astype(np.float64)
+        Rows = np.repeat(np.arange(VertexCount), np.diff(self.SkinOffsets))
+        Kept = (Bones >= 0) & (Weights >= Threshold)
+        Bones, Weights, Rows = Bones[Kept], Weights[Kept], Rows[Kept]
+
+        # Padded to the longest row
+        Counts = np.bincount(Rows, minlength=VertexCount)
+        Width = int(Counts.max()) if VertexCount else 0
+        Columns = np.arange(len(Rows)) - np.repeat(np.cumsum(Counts) - Counts, Counts)
+        PaddedBones = np.full((VertexCount, Width), -1, dtype=np.int32)
+        PaddedWeights = np.full((VertexCount, Width), -1.0)
+        PaddedBones[Rows, Columns] = Bones
+        PaddedWeights[Rows, Columns] = Weights
+
+        if Width > MaximumInfluences:
+            Heaviest = np.argpartition(-PaddedWeights, MaximumInfluences - 1, axis=1)[:, :MaximumInfluences]
+            Heaviest.sort(axis=1)
+            PaddedBones = np.take_along_axis(PaddedBones, Heaviest, axis=1)
+            PaddedWeights = np.take_along_axis(PaddedWeights, Heaviest, axis=1)
+            Counts = np.minimum(Counts, MaximumInfluences)
+
+        PaddedWeights[PaddedBones < 0] = 0.0
+        Totals = PaddedWeights.sum(axis=1, keepdims=True)
+        np.divide(PaddedWeights, Totals, out=PaddedWeights, where=Totals > 0.0)
+        return Counts, PaddedBones, PaddedWeights
+
+    # Mirrors V on every UV layer for the faces using one of the given
+    # material slots.  Works on the extracted arrays only; the mesh keeps its
+    # UVs.  Loops shared by several triangles are flipped once.
+    def FlipV(self, MaterialIndexes):
+        if not self.UVLayers or not MaterialIndexes:
+            return
+
+        CornerMask = np.repeat(np.isin(self.PolygonMaterialIndexes, MaterialIndexes),
+                               self.PolygonLoopTotals)
+        LoopMask = np.zeros(self.LoopCount, dtype=bool)
+        LoopMask[self.CornerLoops[CornerMask]] = True
+
+        for Layer in self.UVLayers:
+            Layer[LoopMask, 1] = 1.0 - Layer[LoopMask, 1]
+
+    # Normals as MeshNormals wants them: a flat shaded polygon gets its face
+    # normal once, a smooth shaded polygon the normal of each of its
+    # vertices, shared with every earlier entry that has the same value.
+    # Normals are compared on a grid of size Tolerance, so the dedup is a
+    # single np.unique over quantized keys instead of a search per corner.
+    #
+    # Returns the unique normals and, for every face corner (in CornerLoops
+    # order), the index of its normal.
+    def GatherNormals(self, Tolerance=1.1920929e-07):
+        Totals = self.PolygonLoopTotals
+        CornerCount = len(self.CornerLoops)
+        if CornerCount == 0:
+            return np.empty((0, 3), dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        CornerPolygons = np.repeat(np.arange(self.PolygonCount), Totals)
+        FirstCorners = np.cumsum(Totals, dtype=np.int64) - Totals
+
+        # One slot per smooth corner plus one per flat polygon (placed at its
+        # first corner), kept in corner order.
+        Flat = ~self.PolygonSmooth
+        SlotMask = self.PolygonSmooth[CornerPolygons]
+        SlotMask[FirstCorners[Flat & (Totals > 0)]] = True
+        SlotCorners = np.flatnonzero(SlotMask)
+        SlotPolygons = CornerPolygons[SlotCorners]
+        SlotFlat = Flat[SlotPolygons]
+
+        SlotNormals = self.VertexNormals[self.LoopVertexIndexes[self.CornerLoops[SlotCorners]]]
+        SlotNormals[SlotFlat] = self.PolygonNormals[SlotPolygons[SlotFlat]]
+
+        Keys = np.rint(SlotNormals / Tolerance).astype(np.int64)
+        _, FirstSlots, KeyGroups = np.unique(Keys, axis=0, return_index=True, return_inverse=True)
+        KeyGroups = KeyGroups.reshape(-1)
+
+        # The first slot of each value always adds a normal, and so does every
+        # flat polygon.  Any later smooth corner reuses the first one.
+        Creates = SlotFlat.copy()
+        Creates[FirstSlots] = True
+        SlotIndexes = np.cumsum(Creates) - 1
+        SlotIndexes = np.where(Creates, SlotIndexes, SlotIndexes[FirstSlots[KeyGroups]])
+
+        # Spread back over the corners: flat polygons use their single slot
+        # for every corner.
+        CornerSlots = np.cumsum(SlotMask) - 1
+        CornerIndexes = SlotIndexes[CornerSlots]
+        FlatCorners = Flat[CornerPolygons]
+        CornerIndexes[FlatCorners] = SlotIndexes[CornerSlots[FirstCorners[CornerPolygons[FlatCorners]]]]
+
+        return SlotNormals[Creates], CornerIndexes
+
+    # Collapses the face corners that would export as identical vertices.
+    # Two corners weld when their position, normal, UV coordinates and (if
+    # Skinned) source vertex, which carries the skin weights, are all bit for
+    # bit the same.  NormalIndexes are the per corner indexes returned by
+    # GatherNormals.
+    #
+    # Returns, for every welded vertex, the face corner it was taken from,
+    # and for every face corner the welded vertex it uses.  Both keep the
+    # order in which the corners first appear.
+    def Weld(self, NormalIndexes, Skinned=False):
+        Loops = self.CornerLoops
+        if len(Loops) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        Vertices = self.LoopVertexIndexes[Loops]
+
+        # + 0.0 folds -0.0 into 0.0 so the bit patterns compare as values
+        Columns = [(self.Positions[Vertices] + 0.0).view(np.int32),
+                   NormalIndexes.reshape(-1, 1)]
+        for Layer in self.UVLayers[:2]:
+            Columns.append((Layer[Loops] + 0.0).view(np.int32))
+        if Skinned:
+            Columns.append(Vertices.reshape(-1, 1))
+        Keys = np.hstack([Column.astype(np.int64) for Column in Columns])
+
+        _, FirstCorners, Inverse = np.unique(Keys, axis=0, return_index=True, return_inverse=True)
+
+        # np.unique numbers the vertices in key order, renumber them in
+        # corner order
+        Order = np.argsort(FirstCorners, kind='stable')
+        Rank = np.empty_like(Order)
+        Rank[Order] = np.arange(len(Order))
+
+        return FirstCorners[Order], Rank[Inverse.reshape(-1)]
@@ -59,74 +59,372 @@
 #####################################################################################
 
 import bpy
+import io
 import os
 import sys
+import queue
+import string
+import threading
 from datetime import datetime
 from bpy.path import basename, ensure_ext
+import numpy as np
+from . func_xfile import FormatBlock, FormatRaggedBlock, FormatBlocks, InterleaveCounts, Signature, \
+    BinaryEncoder, MSZipStream, ParallelFormatter
 
 
 # Interface to the file.  Supports automatic whitespace indenting.
+# Writes are collected in memory and handed to the file in large chunks, and
+# the indentation prefix of the current level is kept ready, so a Write is
+# just a string concatenation and a list append.
+#
+# With Compressed set the file is written as a compressed (tzip) .x file.
+# With Jobs other than 1, large arrays are left in the buffer unformatted and
+# formatted by Jobs worker processes (0: one per core) when it is flushed.
+# With Pipelined set, flushed chunks go through a bounded queue to a writer
+# thread, which formats their arrays and writes them out while the caller
+# carries on producing the next chunk.
+#
+# Output written between BeginCapture and EndCapture is taken out of the file
+# and returned as a chunk of bytes, which WriteChunk splices in, as often as
+# needed (see func_cache and MeshExportObject).  Names written as ChunkName
+# while capturing are replaced by the name given to WriteChunk.
 class File:
-    def __init__(self, FilePath):
+    # Number of characters buffered before they are written out
+    ChunkSize = 1 << 20
+    # Smallest array (in values) worth handing to the worker processes
+    ParallelSize = 1 << 15
+    # Chunks that may wait for the writer thread
+    PipelineDepth = 4
+    # Placeholder for the name in captured chunks.  It only ever goes into
+    # comments, which binary files drop.
+    ChunkName = "\0"
+
+    def __init__(self, FilePath, Compressed=False, Jobs=1, Pipelined=False):
         self.FilePath = FilePath
+        self.Compressed = Compressed
+        self.Jobs = Jobs
+        self.Pipelined = Pipelined
         self.File = None
+        self.__Formatter = None
+        self.__Deferred = []
+        self.__Queue = None
+        self.__Writer = None
+        self.__WriterError = None
         self.__Whitespace = 0
+        self.__Prefixes = [""]
+        self.__Prefix = ""
+        self.__Buffer = []
+        self.__BufferSize = 0
+        self.__CaptureStart = None
+        self.__CaptureSize = 0
 
     def Open(self):
         if not self.File:
-            self.File = open(self.FilePath, 'w')
+            if self.Compressed:
+                # Same encoding and newline handling as a plain text file
+                self.File = io.TextIOWrapper(io.BufferedWriter(
+                    MSZipStream(open(self.FilePath, 'wb'), "tzip")))
+            else:
+                self.File = open(self.FilePath, 'w')
+
+            if self.Pipelined:
+                self.__Queue = queue.Queue(File.PipelineDepth)
+                self.__Writer = threading.Thread(target=self.__WriteChunks, name="X file writer", daemon=True)
+                self.__Writer.start()
 
     def Close(self):
-        self.File.close()
-        self.File = None
+        try:
+            self.Flush()
+        finally:
+            if self.__Writer is not None:
+                self.__Queue.put(None)
+                self.__Writer.join()
+                self.__Writer = None
+            self.File.close()
+            self.File = None
+            if self.__Formatter is not None:
+                self.__Formatter.Close()
+                self.__Formatter = None
+        self.__RaiseWriterError()
+
+    # Gives up on the file after an error: nothing buffered is written, the
+    # writer thread is stopped once it is done with the chunk in hand, the
+    # file is closed as far as it got and the worker processes are shut
+    # down.  Does nothing on a file that is not open.
+    def Abort(self):
+        self.__Buffer = []
+        self.__Deferred = []
+        self.__BufferSize = 0
+        self.__CaptureStart = None
+        if self.__Writer is not None:
+            while True:
+                try:
+                    self.__Queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.__Queue.put(None)
+            self.__Writer.join()
+            self.__Writer = None
+            self.__WriterError = None
+        try:
+            if self.File:
+                self.File.close()
+        finally:
+            self.File = None
+            if self.__Formatter is not None:
+                self.__Formatter.Close()
+                self.__Formatter = None
+
+    # Hands everything buffered so far to the file (or to the writer thread,
+    # which may block until it has caught up).
+    def Flush(self):
+        if not self.__Buffer:
+            return
+        Chunk = (self.__Buffer, self.__Deferred)
+        self.__Buffer = []
+        self.__Deferred = []
+        self.__BufferSize = 0
+
+        if self.__Writer is not None:
+            self.__RaiseWriterError()
+            self.__Queue.put(Chunk)
+        else:
+            self.__WriteChunk(*Chunk)
+
+    def __WriteChunk(self, Buffer, Deferred):
+        if Deferred:
+            Blocks = [Block for Index, Block in Deferred]
+            if self.Jobs != 1:
+                if self.__Formatter is None:
+                    self.__Formatter = ParallelFormatter(self.Jobs)
+                Texts = self.__Formatter.Format(Blocks)
+            else:
+                Texts = FormatBlocks(Blocks)
+            for (Index, Block), Text in zip(Deferred, Texts):
+                Buffer[Index] = Text
+        self.File.write("".join(Buffer))
+
+    # Body of the writer thread.  After an error the remaining chunks are
+    # drained, so the producer never blocks; the error is raised on the next
+    # Flush or Close.
+    def __WriteChunks(self):
+        while True:
+            Chunk = self.__Queue.get()
+            if Chunk is None:
+                return
+            if self.__WriterError is None:
+                try:
+                    self.__WriteChunk(*Chunk)
+                except Exception as Error:
+                    self.__WriterError = Error
+
+    def __RaiseWriterError(self):
+        if self.__WriterError is not None:
+            Error = self.__WriterError
+            self.__WriterError = None
+            raise Error
 
     def Write(self, String, Indent=True):
         if Indent:
-            # Escape any formatting braces
-            String = String.replace("{", "{{")
-            String = String.replace("}", "}}")
-            self.File.write(("{}" + String).format("  " * self.__Whitespace))
+            String = self.__Prefix + String
+        self.__Buffer.append(String)
+        self.__BufferSize += len(String)
+        if self.__BufferSize >= File.ChunkSize and self.__CaptureStart is None:
+            self.Flush()
+
+    # Writes the "xof" line every .x file starts with.  A compressed file
+    # has it written by its stream.
+    def WriteSignature(self):
+        if self.Compressed:
+            self.Write("\n\n")
+        else:
+            self.Write(Signature("txt ") + "\n\n")
+
+    # Writes a whole N x k array (of floats, unless Format says otherwise) as
+    # one block of rows at the current indentation.  See
+    # func_xfile.FormatBlock for the separators.
+    def WriteArray(self, Array, ValueSeparator=";", RowSeparator=";,", Terminator=";;", Format="%9f"):
+        Array = np.asarray(Array)
+        if self.__Defers(Array.size):
+            self.__Defer(("Block", (Array,), (self.__Prefix, Format, ValueSeparator, RowSeparator, Terminator)),
+                         Array.size)
         else:
-            self.File.write(String)
+            self.Write(FormatBlock(Array, self.__Prefix, Format,
+                                   ValueSeparator, RowSeparator, Terminator), Indent=False)
+
+    # Writes a ragged index array (a face list) as one block of rows at the
+    # current indentation.
+    def WriteIndexArray(self, Counts, Indexes, RowSeparator=",", Terminator=";"):
+        Indexes = np.asarray(Indexes)
+        if self.__Defers(Indexes.size):
+            self.__Defer(("Ragged", (np.asarray(Counts), Indexes), (self.__Prefix, RowSeparator, Terminator)),
+                         Indexes.size)
+        else:
+            self.Write(FormatRaggedBlock(Counts, Indexes, self.__Prefix,
+                                         RowSeparator, Terminator), Indent=False)
+
+    # Arrays are formatted when their chunk is written if that happens in
+    # another thread or in worker processes.
+    def __Defers(self, ValueCount):
+        return self.Pipelined or (self.Jobs != 1 and ValueCount >= File.ParallelSize)
+
+    # Keeps the place of a block in the buffer until its chunk is written.  A
+    # formatted value takes about 10 characters.
+    def __Defer(self, Block, ValueCount):
+        self.__Deferred.append((len(self.__Buffer), Block))
+        self.__Buffer.append(None)
+        self.__BufferSize += ValueCount * 10
+        if self.__BufferSize >= File.ChunkSize and self.__CaptureStart is None:
+            self.Flush()
+
+    # The buffer is not flushed while capturing, so the captured output stays
+    # in it until EndCapture.
+    def BeginCapture(self):
+        self.__CaptureStart = len(self.__Buffer)
+        self.__CaptureSize = self.__BufferSize
+
+    # Takes everything written since BeginCapture out of the buffer and
+    # returns it.  Arrays deferred in that span are formatted here, in this
+    # thread.
+    def EndCapture(self):
+        Start = self.__CaptureStart
+        self.__CaptureStart = None
+        Captured = [(Index, Block) for Index, Block in self.__Deferred if Index >= Start]
+        if Captured:
+            self.__Deferred = [(Index, Block) for Index, Block in self.__Deferred if Index < Start]
+            for (Index, Block), Text in zip(Captured, FormatBlocks([Block for Index, Block in Captured])):
+                self.__Buffer[Index] = Text
+        Chunk = "".join(self.__Buffer[Start:]).encode("utf-8")
+        del self.__Buffer[Start:]
+        self.__BufferSize = self.__CaptureSize
+        return Chunk
+
+    # Writes a chunk returned by EndCapture, with Name in place of ChunkName
+    def WriteChunk(self, Chunk, Name=""):
+        self.Write(Chunk.decode("utf-8").replace(File.ChunkName, Name), Indent=False)
 
     def Indent(self, Levels=1):
         self.__Whitespace += Levels
+        self.__UpdatePrefix()
 
     def Unindent(self, Levels=1):
         self.__Whitespace -= Levels
         if self.__Whitespace < 0:
             self.__Whitespace = 0
+        self.__UpdatePrefix()
+
+    # Indentation prefix of the current level
+    @property
+    def Indentation(self):
+        return self.__Prefix
+
+    def __UpdatePrefix(self):
+        while len(self.__Prefixes) <= self.__Whitespace:
+            self.__Prefixes.append("  " * len(self.__Prefixes))
+        self.__Prefix = self.__Prefixes[self.__Whitespace]
+
+
+# Binary .x file with the same interface (bzip when Compressed).  Text
+# written to it is encoded into binary tokens (comments and indentation are
+# dropped), arrays go straight from their NumPy buffers into integer and
+# float lists.
+class BinaryFile(File):
+    def __init__(self, FilePath, Compressed=False):
+        File.__init__(self, FilePath, Compressed)
+        self.Encoder = BinaryEncoder()
+        self.__CaptureStart = None
+
+    def Open(self):
+        if not self.File:
+            if self.Compressed:
+                self.File = MSZipStream(open(self.FilePath, 'wb'), "bzip")
+            else:
+                self.File = open(self.FilePath, 'wb')
+
+    def Close(self):
+        self.Encoder.Finish()
+        self.Flush()
+        self.File.close()
+        self.File = None
+
+    def Flush(self):
+        if self.__CaptureStart is None:
+            self.File.write(self.Encoder.Take())
+
+    def WriteSignature(self):
+        if not self.Compressed:
+            self.Flush()
+            self.File.write(Signature("bin ").encode("ascii"))
+
+    def Write(self, String, Indent=True):
+        self.Encoder.Feed(String)
+        if len(self.Encoder.Output) >= File.ChunkSize:
+            self.Flush()
+
+    def WriteArray(self, Array, ValueSeparator=";", RowSeparator=";,", Terminator=";;", Format="%9f"):
+        self.Encoder.FeedArray(Array, Integer=Format[-1] in "di")
+        if len(self.Encoder.Output) >= File.ChunkSize:
+            self.Flush()
+
+    def WriteIndexArray(self, Counts, Indexes, RowSeparator=",", Terminator=";"):
+        self.Encoder.FeedArray(InterleaveCounts(Counts, Indexes), Integer=True)
+        if len(self.Encoder.Output) >= File.ChunkSize:
+            self.Flush()
+
+    # Captured chunks are the encoded tokens.  Chunks start and end between
+    # statements, where no token is left pending in the encoder.
+    def BeginCapture(self):
+        self.Encoder.Finish()
+        self.__CaptureStart = len(self.Encoder.Output)
+
+    def EndCapture(self):
+        self.Encoder.Finish()
+        Chunk = bytes(self.Encoder.Output[self.__CaptureStart:])
+        del self.Encoder.Output[self.__CaptureStart:]
+        self.__CaptureStart = None
+        return Chunk
+
+    # Comments are not encoded, so there is no name to replace
+    def WriteChunk(self, Chunk, Name=""):
+        self.Encoder.Finish()
+        self.Encoder.Output += Chunk
+        if len(self.Encoder.Output) >= File.ChunkSize:
+            self.Flush()
 
 
 # Some general purpose utilities
 class Util:
+    # Every punctuation character and the space become "_" in a SafeName.
+    # SafeName is asked for the same names over and over (every bone of
+    # every skinned mesh), so the results are memoized; the memo is simply
+    # dropped when it grows past __SafeNameMemoSize names.
+    __SafeNameTable = str.maketrans({Char: "_" for Char in string.punctuation + " "})
+    __ReservedNames = frozenset(["ARRAY", "DWORD", "UCHAR",
+                                 "FLOAT", "ULONGLONG", "BINARY_RESOURCE", "SDWORD", "UNICODE",
+                                 "CHAR", "STRING", "WORD", "CSTRING", "SWORD", "DOUBLE", "TEMPLATE"])
+    __SafeNameMemo = {}
+    __SafeNameMemoSize = 4096
+
     @staticmethod
     def SafeName(Name):
-        # Replaces each character in OldSet with NewChar
-        def ReplaceSet(String, OldSet, NewChar):
-            for OldChar in OldSet:
-                String = String.replace(OldChar, NewChar)
-            return String
-
-        import string
-
-        NewName = ReplaceSet(Name, string.punctuation + " ", "_")
-        if NewName[0].isdigit() or NewName in ["ARRAY", "DWORD", "UCHAR",
-                                               "FLOAT", "ULONGLONG", "BINARY_RESOURCE", "SDWORD", "UNICODE",
-                                               "CHAR", "STRING", "WORD", "CSTRING", "SWORD", "DOUBLE", "TEMPLATE"]:
+        NewName = Util.__SafeNameMemo.get(Name)
+        if NewName is not None:
+            return NewName
+
+        NewName = Name.translate(Util.__SafeNameTable)
+        if NewName[0].isdigit() or NewName in Util.__ReservedNames:
             NewName = "_" + NewName
+
+        if len(Util.__SafeNameMemo) >= Util.__SafeNameMemoSize:
+            Util.__SafeNameMemo.clear()
+        Util.__SafeNameMemo[Name] = NewName
         return NewName
 
     @staticmethod
     def WriteMatrix(File, Matrix):
-        File.Write("{:9f},{:9f},{:9f},{:9f},\n".format(Matrix[0][0],
-                   Matrix[1][0], Matrix[2][0], Matrix[3][0]))
-        File.Write("{:9f},{:9f},{:9f},{:9f},\n".format(Matrix[0][1],
-                   Matrix[1][1], Matrix[2][1], Matrix[3][1]))
-        File.Write("{:9f},{:9f},{:9f},{:9f},\n".format(Matrix[0][2],
-                   Matrix[1][2], Matrix[2][2], Matrix[3][2]))
-        File.Write("{:9f},{:9f},{:9f},{:9f};;\n".format(Matrix[0][3],
-                   Matrix[1][3], Matrix[2][3], Matrix[3][3]))
+        # .x matrices are stored column by column
+        File.WriteArray([Column[:] for Column in Matrix.col],
+                        ValueSeparator=",", RowSeparator=",")
 
     # Used on lists of blender objects and lists of ExportObjects, both of
     # which have a name field
@@ -159,3 +457,117 @@ class Util:
             msg += " DONE " + datetime.now().strftime("%m/%d/%Y %H:%M:%S") + "\r\n"
         sys.stdout.write(msg)
         sys.stdout.flush()
+
+
+# Hierarchy of the exported objects, indexed by the Blender object (or bone)
+# each ExportObject stands for.  While the graph is built and pruned, the
+# children of a node are kept in a dict, so linking and unlinking a child is
+# O(1) and a removed node hands its children to its parent directly.
+# Finish() then gives every ExportObject its Parent and its Children, sorted
+# by name once.  All traversals use an explicit stack, so deep hierarchies
+# never run into Python's recursion limit.
+class SceneGraph:
+    def __init__(self):
+        self.Nodes = {}
+        self.__Parents = {}
+        self.__Children = {}
+        self.__Roots = {}
+
+    def __len__(self):
+        return len(self.Nodes)
+
+    def __contains__(self, Key):
+        return Key in self.Nodes
+
+    def __getitem__(self, Key):
+        return self.Nodes[Key]
+
+    # Adds a node, as a root
+    def Add(self, Key, Node):
+        self.Nodes[Key] = Node
+        self.__Parents[Key] = None
+        self.__Children[Key] = {}
+        self.__Roots[Key] = None
+
+    # Makes ParentKey the parent of Key (None makes it a root)
+    def Link(self, Key, ParentKey):
+        self.__Unlink(Key)
+        self.__Parents[Key] = ParentKey
+        if ParentKey is None:
+            self.__Roots[Key] = None
+        else:
+            self.__Children[ParentKey][Key] = None
+
+    def __Unlink(self, Key):
+        ParentKey = self.__Parents[Key]
+        if ParentKey is None:
+            del self.__Roots[Key]
+        else:
+            del self.__Children[ParentKey][Key]
+
+    # Takes a node out of the graph and returns it.  Its children move to
+    # its parent.
+    def Remove(self, Key):
+        ParentKey = self.__Parents[Key]
+        for ChildKey in list(self.__Children[Key]):
+            self.Link(ChildKey, ParentKey)
+        self.__Unlink(Key)
+        del self.__Parents[Key]
+        del self.__Children[Key]
+        return self.Nodes.pop(Key)
+
+    # Removes every node for which Keep(Key, Node) is false, in one top-down
+    # pass.  A parent is always decided before its children, so each node
+    # moves at most once and the whole pass is linear.
+    def Prune(self, Keep):
+        Stack = list(reversed(self.__Roots))
+        while Stack:
+            Key = Stack.pop()
+            Stack.extend(reversed(self.__Children[Key]))
+            if not Keep(Key, self.Nodes[Key]):
+                self.Remove(Key)
+
+    # Sets Parent and Children of every node and returns the roots, sorted
+    # by name
+    def Finish(self):
+        for Key, Node in self.Nodes.items():
+            ParentKey = self.__Parents[Key]
+            Node.Parent = None if ParentKey is None else self.Nodes[ParentKey]
+            Node.Children = Util.SortByNameField(self.Nodes[ChildKey] for ChildKey in self.__Children[Key])
+        return Util.SortByNameField(self.Nodes[Key] for Key in self.__Roots)
+
+
+# Hands out the frame names of one export.  Different Blender names can give
+# the same SafeName ("Rivet.001" and "Rivet 001" both give "Rivet_001"), and
+# two frames with one name make XToMdl fail.  The first frame to claim a name
+# keeps it, later ones get "_1", "_2"... appended; the exporter claims the
+# names in the order of the sorted export list, so the result is the same on
+# every export.
+class FrameNames:
+    def __init__(self):
+        self.__Names = {}
+        self.__Taken = set()
+        self.Collisions = []
+
+    # Returns the unique frame name of the frame Key, made from SafeName the
+    # first time Key claims a name
+    def Claim(self, Key, SafeName):
+        Name = self.__Names.get(Key)
+        if Name is not None:
+            return Name
+
+        Name = SafeName
+        Suffix = 1
+        while Name in self.__Taken:
+            Name = "{}_{}".format(SafeName, Suffix)
+            Suffix += 1
+        if Name != SafeName:
+            self.Collisions.append((SafeName, Name))
+
+        self.__Names[Key] = Name
+        self.__Taken.add(Name)
+        return Name
+
+    # The frame name claimed by Key, or Default if Key never claimed one
+    def Get(self, Key, Default):
+        return self.__Names.get(Key, Default)
@@ -0,0 +1,568 @@
+#####################################################################################
+#
+#  Blender2P3D/FSX
+#
+#####################################################################################
+#
+# The addon in its current version is the hard work of many members of the
+# fsdeveloper.com forum. The original FSX2Blender addon was developed by:
+#   Felix Owono-Ateba
+#   Ron Haertel
+#   Kris Pyatt (2017)
+#   Manochvarma Raman (2018)
+#
+# This current incarnation of the addon uses most of the original algorithms,
+# but with an updated UI and compatibility for Blender 2.8x. Parts of the
+# original exporter script have been re-written to accommodate Blender's new
+# material workflow and to add PBR support to the addon (P3D v4.4+/v5 only).
+#
+# The conversion for Blender 2.8x was done by:
+#   Otmar Nitsche (2019/2020)
+#
+# Further enhancement to the material workflow were coded by:
+#   David Hoeffgen (2020)
+#
+# For information on how to use the addon, please visit:
+# https://www.fsdeveloper.com/wiki/index.php?title=Blender2P3D/FSX
+#
+# If you have any questions, or suggestions, visit the support thread under:
+# https://www.fsdeveloper.com/forum/forums/blender.136/
+#
+# For the original Blender2FSX addon, visit:
+# https://www.fsdeveloper.com/forum/threads/blender2fsx-p3d-v0-9-5-onwards.442082/
+#
+# Special thanks go to Arno Gerretsen and Bill Womack for their input during the
+# development and testing of the addon.
+#
+# The software is licensed under GNU General Public License (GNU-GPL-3).
+# Feel free to use it as you see fit, both for freeware and commercial projects.
+# If you have suggestions for changes, use the support thread in the
+# fsdeveloper.com forum. If you would like to get involved in the development
+# of the addon, contact any of the authors mentioned above to coordinate
+# the effort.
+#
+#####################################################################################
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTIBILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#####################################################################################
+
+import io
+import os
+import re
+import sys
+import struct
+import zlib
+import importlib
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+
+# Magic number and format version every .x file starts with, followed by the
+# 4 character format ("txt ", "bin ", "tzip", "bzip") and the float size.
+def Signature(Format):
+    return "xof 0302{}0032".format(Format)
+
+
+# Text formatting of whole .x data blocks.  A block is written as one string
+# built from a %-template, so every row costs a few characters of template
+# instead of a format() call and a File.Write per value and separator.  The
+# templates use %9f, which prints exactly what {:9f} does.
+#
+# Nothing in here depends on bpy.
+
+# Rows of an N x k array, one row per line:
+#   <Indent>v0<ValueSeparator>v1...<RowSeparator>\n
+# with Terminator in place of RowSeparator on the last row.  The defaults
+# give the vector lists of Mesh, MeshNormals and MeshTextureCoords:
+#   x;y;z;,
+#   x;y;z;;
+def FormatBlock(Array, Indent="", Format="%9f", ValueSeparator=";", RowSeparator=";,", Terminator=";;"):
+    Array = np.asarray(Array)
+    if Array.ndim == 1:
+        Array = Array.reshape(-1, 1)
+    RowCount = len(Array)
+    if RowCount == 0:
+        return ""
+
+    Row = Indent + ValueSeparator.join([Format] * Array.shape[1])
+    Template = (Row + RowSeparator + "\n") * (RowCount - 1) + Row + Terminator + "\n"
+    return Template % tuple(Array.ravel().tolist())
+
+
+# Rows of a ragged index array, as the face lists of Mesh and MeshNormals:
+#   <Indent>n;i0,i1,...;<RowSeparator>\n
+# Counts[r] is the length of row r, Indexes holds all rows back to back.
+def FormatRaggedBlock(Counts, Indexes, Indent="", RowSeparator=",", Terminator=";"):
+    Counts = np.asarray(Counts)
+    RowCount = len(Counts)
+    if RowCount == 0:
+        return ""
+
+    Rows = {}
+    for Count in np.unique(Counts).tolist():
+        Rows[Count] = Indent + "{};".format(Count) + ",".join(["%d"] * Count) + ";"
+    Template = (RowSeparator + "\n").join([Rows[Count] for Count in Counts.tolist()]) + Terminator + "\n"
+    return Template % tuple(np.asarray(Indexes).tolist())
+
+
+# Reverses the order of the indexes within each row of a ragged index array,
+# which flips the winding of the faces it describes.
+def ReverseRows(Counts, Indexes):
+    Counts = np.asarray(Counts, dtype=np.int64)
+    Starts = np.cumsum(Counts) - Counts
+    RowStarts = np.repeat(Starts, Counts)
+    RowEnds = np.repeat(Starts + Counts - 1, Counts)
+    return np.asarray(Indexes)[RowStarts + RowEnds - np.arange(len(RowStarts))]
+
+
+# Formats blocks given as ParallelFormatter takes them, in this process.
+def FormatBlocks(Blocks):
+    return [FormatBlock(Arrays[0], *Arguments) if Kind == "Block" else
+            FormatRaggedBlock(Arrays[0], Arrays[1], *Arguments)
+            for Kind, Arrays, Arguments in Blocks]
+
+
+# Formats blocks of .x text in worker processes.  The arrays of a batch of
+# blocks are copied into one shared memory segment, and the workers get only
+# their location in it, so no array is pickled.  Large blocks are cut into row
+# ranges formatted separately; the pieces, put back together in order, are
+# exactly the text FormatBlock and FormatRaggedBlock produce.
+#
+# Each block is a tuple (Kind, Arrays, Arguments), Kind being "Block" for
+# FormatBlock(Array, *Arguments) or "Ragged" for
+# FormatRaggedBlock(Counts, Indexes, *Arguments).
+class ParallelFormatter:
+    # Rows per task
+    TaskRows = 1 << 16
+
+    def __init__(self, Jobs=0):
+        # The workers import this file as a top level module, which needs no
+        # bpy.  Spawned processes inherit sys.path from this one.
+        self.__Directory = os.path.dirname(os.path.abspath(__file__))
+        self.__AddedPath = self.__Directory not in sys.path
+        if self.__AddedPath:
+            sys.path.append(self.__Directory)
+        self.__Worker = importlib.import_module("func_xfile")._FormatShared
+
+        self.Executor = ProcessPoolExecutor(max_workers=Jobs or os.cpu_count(),
+                                            mp_context=multiprocessing.get_context("spawn"))
+
+    def Close(self):
+        self.Executor.shutdown()
+        if self.__AddedPath and self.__Directory in sys.path:
+            sys.path.remove(self.__Directory)
+
+    def Format(self, Blocks):
+        Arrays = [np.ascontiguousarray(Array) for Kind, BlockArrays, Arguments in Blocks
+                  for Array in BlockArrays]
+        Offsets = []
+        Size = 0
+        for Array in Arrays:
+            Offsets.append(Size)
+            Size += (Array.nbytes + 15) & ~15
+
+        Memory = shared_memory.SharedMemory(create=True, size=max(Size, 1))
+        try:
+            for Array, Offset in zip(Arrays, Offsets):
+                np.ndarray(Array.shape, Array.dtype, Memory.buf, Offset)[...] = Array
+
+            # Cut every block into tasks of TaskRows rows
+            Tasks = []
+            Owners = []
+            Position = 0
+            for Index, (Kind, BlockArrays, Arguments) in enumerate(Blocks):
+                Specs = [(Offsets[Position + Number], Array.dtype.str, Array.shape)
+                         for Number, Array in enumerate(Arrays[Position:Position + len(BlockArrays)])]
+                Position += len(BlockArrays)
+                for Task in _SplitRows(Kind, BlockArrays, Specs, Arguments, ParallelFormatter.TaskRows):
+                    Tasks.append(Task)
+                    Owners.append(Index)
+
+            Results = [[] for Block in Blocks]
+            Pieces = self.Executor.map(self.__Worker, [Memory.name] * len(Tasks), *zip(*Tasks))
+            for Index, Piece in zip(Owners, Pieces):
+                Results[Index].append(Piece)
+        finally:
+            Memory.close()
+            Memory.unlink()
+
+        return ["".join(Pieces) for Pieces in Results]
+
+
+# Cuts one block into row ranges.  Every range but the last ends its last row
+# with the row separator instead of the terminator.
+def _SplitRows(Kind, Arrays, Specs, Arguments, Rows):
+    def Slice(Spec, Start, Stop, Width):
+        Offset, DataType, Shape = Spec
+        ItemSize = np.dtype(DataType).itemsize * Width
+        return (Offset + Start * ItemSize, DataType, (Stop - Start,) + tuple(Shape[1:]))
+
+    if Kind == "Block":
+        Offset, DataType, Shape = Specs[0]
+        RowCount = Shape[0]
+        Width = int(np.prod(Shape[1:], dtype=np.int64))
+        Indent, Format, ValueSeparator, RowSeparator, Terminator = Arguments
+        for Start in range(0, RowCount, Rows):
+            Stop = min(Start + Rows, RowCount)
+            yield (Kind, [Slice(Specs[0], Start, Stop, Width)],
+                   (Indent, Format, ValueSeparator, RowSeparator,
+                    Terminator if Stop == RowCount else RowSeparator))
+    else:
+        # Row lengths decide where the index ranges start
+        Counts = np.asarray(Arrays[0])
+        Indent, RowSeparator, Terminator = Arguments
+        RowCount = len(Counts)
+        Starts = np.concatenate(([0], np.cumsum(Counts, dtype=np.int64)))
+        for Start in range(0, RowCount, Rows):
+            Stop = min(Start + Rows, RowCount)
+            yield (Kind, [Slice(Specs[0], Start, Stop, 1),
+                          Slice(Specs[1], int(Starts[Start]), int(Starts[Stop]), 1)],
+                   (Indent, RowSeparator, Terminator if Stop == RowCount else RowSeparator))
+
+
+def _Attach(Spec, Buffer):
+    Offset, DataType, Shape = Spec
+    return np.ndarray(Shape, DataType, Buffer, Offset)
+
+
+# Worker side of ParallelFormatter
+def _FormatShared(Name, Kind, Specs, Arguments):
+    try:
+        Memory = shared_memory.SharedMemory(name=Name, track=False)
+    except TypeError:
+        # track only exists from Python 3.13 on
+        Memory = shared_memory.SharedMemory(name=Name)
+    try:
+        Arrays = [_Attach(Spec, Memory.buf) for Spec in Specs]
+        Text = FormatBlocks([(Kind, Arrays, Arguments)])[0]
+        del Arrays
+    finally:
+        Memory.close()
+    return Text
+
+
+# Interleaves a ragged index array with its row lengths, the layout of an
+# array of MeshFace: n0, i0, i1, ..., n1, i0, ...
+def InterleaveCounts(Counts, Indexes):
+    Counts = np.asarray(Counts, dtype=np.int64)
+    Rows = np.cumsum(Counts + 1) - (Counts + 1)
+    Interleaved = np.empty(len(Counts) + int(Counts.sum()), dtype=np.int64)
+    Mask = np.ones(len(Interleaved), dtype=bool)
+    Mask[Rows] = False
+    Interleaved[Rows] = Counts
+    Interleaved[Mask] = Indexes
+    return Interleaved
+
+
+# Tokens of the binary .x format
+TOKEN_NAME = 1
+TOKEN_STRING = 2
+TOKEN_INTEGER = 3
+TOKEN_GUID = 5
+TOKEN_INTEGER_LIST = 6
+TOKEN_FLOAT_LIST = 7
+TOKEN_OBRACE = 10
+TOKEN_CBRACE = 11
+TOKEN_OPAREN = 12
+TOKEN_CPAREN = 13
+TOKEN_OBRACKET = 14
+TOKEN_CBRACKET = 15
+TOKEN_OANGLE = 16
+TOKEN_CANGLE = 17
+TOKEN_DOT = 18
+TOKEN_COMMA = 19
+TOKEN_SEMICOLON = 20
+TOKEN_TEMPLATE = 31
+TOKEN_WORD = 40
+TOKEN_DWORD = 41
+TOKEN_FLOAT = 42
+TOKEN_DOUBLE = 43
+TOKEN_CHAR = 44
+TOKEN_UCHAR = 45
+TOKEN_SWORD = 46
+TOKEN_SDWORD = 47
+TOKEN_VOID = 48
+TOKEN_LPSTR = 49
+TOKEN_UNICODE = 50
+TOKEN_CSTRING = 51
+TOKEN_ARRAY = 52
+
+_Punctuation = {"{": TOKEN_OBRACE, "}": TOKEN_CBRACE, "(": TOKEN_OPAREN, ")": TOKEN_CPAREN,
+                "[": TOKEN_OBRACKET, "]": TOKEN_CBRACKET, "<": TOKEN_OANGLE, ">": TOKEN_CANGLE,
+                ".": TOKEN_DOT, ",": TOKEN_COMMA, ";": TOKEN_SEMICOLON}
+
+# Keywords only have a token of their own inside template definitions
+_Keywords = {"template": TOKEN_TEMPLATE, "WORD": TOKEN_WORD, "DWORD": TOKEN_DWORD,
+             "FLOAT": TOKEN_FLOAT, "DOUBLE": TOKEN_DOUBLE, "CHAR": TOKEN_CHAR,
+             "UCHAR": TOKEN_UCHAR, "SWORD": TOKEN_SWORD, "SDWORD": TOKEN_SDWORD,
+             "VOID": TOKEN_VOID, "STRING": TOKEN_LPSTR, "UNICODE": TOKEN_UNICODE,
+             "CSTRING": TOKEN_CSTRING, "array": TOKEN_ARRAY}
+
+_Lexer = re.compile(r"""
+    \s+ | //[^\n]* | \#[^\n]*
+  | "(?P<String>[^"]*)"
+  | <(?P<Guid>[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12})>
+  | (?P<Integer>[-+]?\d+)(?![\d.eE])
+  | (?P<Float>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?(?i:nan|inf)\b)
+  | (?P<Name>[A-Za-z_][A-Za-z0-9_-]*)
+  | (?P<Punctuation>[{}()\[\]<>.,;])
+""", re.X)
+
+
+# Turns .x text into the token stream of a binary .x file.  The text is fed in
+# the pieces the writers produce; anything after the last line break is held
+# back until more text arrives, so tokens may be split across pieces.  Large
+# arrays bypass the text entirely and are fed as NumPy arrays.
+#
+# In data objects the separators are dropped (except the one ending a
+# string) and runs of numbers become integer or float lists, telling the two
+# apart by whether the text has a decimal point or exponent, exactly as the
+# writers format DWORD and FLOAT members.  Template definitions are encoded
+# token for token.
+class BinaryEncoder:
+    def __init__(self):
+        self.Output = bytearray()
+        self.__Text = ""
+        self.__InTemplate = False
+        self.__StringOpen = False
+        # Pending number run: its token, and a list of NumPy arrays
+        self.__ListToken = None
+        self.__List = []
+
+    # Takes the encoded bytes produced so far.
+    def Take(self):
+        Output = bytes(self.Output)
+        self.Output = bytearray()
+        return Output
+
+    def Feed(self, Text):
+        self.__Text += Text
+        End = self.__Text.rfind("\n") + 1
+        if End:
+            self.__Encode(self.__Text[:End])
+            self.__Text = self.__Text[End:]
+
+    # Appends a whole array of numbers to the current data object.
+    def FeedArray(self, Array, Integer=False):
+        self.__FlushText()
+        if Integer:
+            self.__AddNumbers(TOKEN_INTEGER_LIST, np.asarray(Array, dtype="<i4").ravel())
+        else:
+            self.__AddNumbers(TOKEN_FLOAT_LIST, np.asarray(Array, dtype="<f4").ravel())
+
+    # Encodes everything fed so far, including an unterminated last line.
+    def Finish(self):
+        self.__FlushText()
+        self.__FlushList()
+
+    def __FlushText(self):
+        if self.__Text:
+            self.__Encode(self.__Text)
+            self.__Text = ""
+
+    def __AddNumbers(self, Token, Numbers):
+        if Token != self.__ListToken:
+            self.__FlushList()
+            self.__ListToken = Token
+        self.__List.append(Numbers)
+
+    def __FlushList(self):
+        if self.__ListToken is None:
+            return
+        Numbers = np.concatenate(self.__List) if len(self.__List) > 1 else self.__List[0]
+        self.Output += struct.pack("<HI", self.__ListToken, len(Numbers))
+        self.Output += Numbers.tobytes()
+        self.__ListToken = None
+        self.__List = []
+
+    def __Token(self, Token):
+        self.Output += struct.pack("<H", Token)
+
+    def __Name(self, Name):
+        Name = Name.encode("ascii", "replace")
+        self.Output += struct.pack("<HI", TOKEN_NAME, len(Name)) + Name
+
+    def __Guid(self, Guid):
+        Parts = Guid.split("-")
+        self.Output += struct.pack("<HIHH", TOKEN_GUID, int(Parts[0], 16), int(Parts[1], 16), int(Parts[2], 16))
+        self.Output += bytes.fromhex(Parts[3] + Parts[4])
+
+    def __Encode(self, Text):
+        Integers = []
+        Floats = []
+
+        # Numbers are collected per run and converted in one go
+        def FlushNumbers():
+            if Integers:
+                self.__AddNumbers(TOKEN_INTEGER_LIST, np.array(Integers, dtype="<i8").astype("<i4"))
+                Integers.clear()
+            if Floats:
+                self.__AddNumbers(TOKEN_FLOAT_LIST, np.array(Floats, dtype="<f4"))
+                Floats.clear()
+
+        for Match in _Lexer.finditer(Text):
+            Kind = Match.lastgroup
+            if Kind is None:
+                continue
+
+            if self.__InTemplate:
+                if Kind == "Name":
+                    Name = Match.group(Kind)
+                    if Name in _Keywords:
+                        self.__Token(_Keywords[Name])
+                    else:
+                        self.__Name(Name)
+                elif Kind == "Integer":
+                    self.Output += struct.pack("<HI", TOKEN_INTEGER, int(Match.group(Kind)))
+                elif Kind == "Guid":
+                    self.__Guid(Match.group(Kind))
+                elif Kind == "Punctuation":
+                    Character = Match.group(Kind)
+                    self.__Token(_Punctuation[Character])
+                    if Character == "}":
+                        self.__InTemplate = False
+                else:
+                    raise ValueError("Unexpected {} in template: {}".format(Kind, Match.group(Kind)))
+                continue
+
+            if Kind == "Integer":
+                if Floats:
+                    FlushNumbers()
+                Integers.append(int(Match.group(Kind)))
+                continue
+            if Kind == "Float":
+                if Integers:
+                    FlushNumbers()
+                Floats.append(float(Match.group(Kind)))
+                continue
+
+            if Kind == "Punctuation":
+                Character = Match.group(Kind)
+                if Character in ",;":
+                    # Separators only survive as string terminators
+                    if self.__StringOpen:
+                        self.__Token(_Punctuation[Character])
+                        self.__StringOpen = False
+                    continue
+
+            FlushNumbers()
+            self.__FlushList()
+            if self.__StringOpen:
+                self.__Token(TOKEN_SEMICOLON)
+                self.__StringOpen = False
+
+            if Kind == "String":
+                String = Match.group(Kind).encode("latin-1", "replace")
+                self.Output += struct.pack("<HI", TOKEN_STRING, len(String)) + String
+                self.__StringOpen = True
+            elif Kind == "Name":
+                Name = Match.group(Kind)
+                if Name == "template":
+                    self.__Token(TOKEN_TEMPLATE)
+                    self.__InTemplate = True
+                else:
+                    self.__Name(Name)
+            elif Kind == "Guid":
+                self.__Guid(Match.group(Kind))
+            else:
+                self.__Token(_Punctuation[Match.group(Kind)])
+
+        FlushNumbers()
+
+
+# Compressed .x file ("tzip" for text, "bzip" for binary).  After the 16 byte
+# signature comes the size of the whole uncompressed file (signature
+# included) and a series of MSZIP blocks, each one:
+#   WORD uncompressed size (at most 32 KB), WORD compressed size + 2, "CK",
+#   a complete raw deflate stream primed with the previous block.
+# Data is compressed block by block as it is written, the size is patched in
+# when the stream is closed.
+class MSZipStream(io.RawIOBase):
+    BlockSize = 32768
+
+    def __init__(self, Stream, Format):
+        io.RawIOBase.__init__(self)
+        self.Stream = Stream
+        self.Stream.write(Signature(Format).encode("ascii"))
+        self.Stream.write(struct.pack("<I", 0))
+        self.__Pending = bytearray()
+        self.__Dictionary = b""
+        self.__Size = 16
+
+    def writable(self):
+        return True
+
+    def write(self, Data):
+        self.__Pending += Data
+        self.__Size += len(Data)
+        if len(self.__Pending) >= MSZipStream.BlockSize:
+            End = len(self.__Pending) - len(self.__Pending) % MSZipStream.BlockSize
+            for Start in range(0, End, MSZipStream.BlockSize):
+                self.__WriteBlock(bytes(self.__Pending[Start:Start + MSZipStream.BlockSize]))
+            del self.__Pending[:End]
+        return len(Data)
+
+    def close(self):
+        if not self.closed:
+            if self.__Pending:
+                self.__WriteBlock(bytes(self.__Pending))
+                self.__Pending = bytearray()
+            self.Stream.seek(16)
+            self.Stream.write(struct.pack("<I", self.__Size))
+            self.Stream.close()
+        io.RawIOBase.close(self)
+
+    def __WriteBlock(self, Block):
+        if self.__Dictionary:
+            Compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self.__Dictionary)
+        else:
+            Compressor = zlib.compressobj(9, zlib.DEFLATED, -15)
+        Compressed = Compressor.compress(Block) + Compressor.flush(zlib.Z_FINISH)
+        self.Stream.write(struct.pack("<HH", len(Block), len(Compressed) + 2) + b"CK" + Compressed)
+        self.__Dictionary = Block
+
+
+# Expands a compressed .x file (the bytes of the whole file) into the text or
+# binary .x file it was made from.
+def Decompress(Data):
+    Formats = {b"tzip": "txt ", b"bzip": "bin "}
+    if Data[:8] != b"xof 0302" or Data[8:12] not in Formats:
+        raise ValueError("Not a compressed .x file")
+    Size, = struct.unpack_from("<I", Data, 16)
+
+    Blocks = [Signature(Formats[Data[8:12]]).encode("ascii")]
+    Dictionary = b""
+    Position = 20
+    while Position < len(Data):
+        Uncompressed, Compressed = struct.unpack_from("<HH", Data, Position)
+        if Data[Position + 4:Position + 6] != b"CK":
+            raise ValueError("Bad MSZIP block at offset {}".format(Position))
+        if Dictionary:
+            Decompressor = zlib.decompressobj(-15, zdict=Dictionary)
+        else:
+            Decompressor = zlib.decompressobj(-15)
+        Block = Decompressor.decompress(Data[Position + 6:Position + 4 + Compressed])
+        if len(Block) != Uncompressed:
+            raise ValueError("Bad MSZIP block size at offset {}".format(Position))
+        Blocks.append(Block)
+        Dictionary = Block
+        Position += 4 + Compressed
+
+    Output = b"".join(Blocks)
+    if len(Output) != Size:
+        raise ValueError("Compressed .x file is truncated")
+    return Output
@@ -59,10 +59,17 @@
 #####################################################################################
 
 import bpy
+import numpy as np
 
 from pathlib import Path
 from mathutils import Vector, Matrix, Quaternion
 from . func_util import Util
+from . func_mesh import MeshData, IsTriangulated
+from . func_xfile import ReverseRows
+from . func_cache import MaterialSignature, ModifierSignature, SkinSignature
+from . func_fcurves import FCurveTransform
+from . func_keys import QuaternionConjugate, QuaternionDifference, QuaternionAngle, MakeContinuous, \
+    ReduceKeys, Slerp, Lerp, Distance
 
 
 class ExportError(Exception):
@@ -90,15 +97,29 @@ class ExportObject:  # Base class, do not use
 
     # "Public" Interface
 
+    # Writes the frame of this object with the frames of all the objects
+    # below it nested inside.  The hierarchy is walked with an explicit
+    # stack, so its depth is not limited by the recursion limit.
     def Write(self):
-        self._OpenFrame()
+        Stack = [(self, False)]
+        while Stack:
+            Object, Close = Stack.pop()
+            if Close:
+                Object._CloseFrame()
+                continue
+            if Object is not self:
+                self.Exporter.log.log("Writing information of %s" % Object.name, True, True)
+            Object._OpenFrame()
+            Object._WriteContent()
+            Stack.append((Object, True))
+            Stack.extend((Child, False) for Child in reversed(Object.Children))
 
-        self.Exporter.File.Write("AnimLinkName {{ \"{}\"; }}\n" .format(self.SafeName))
-        self._WriteChildren()
+    # "Protected" Interface
 
-        self._CloseFrame()
+    # Writes what the frame holds besides its transform and its children
+    def _WriteContent(self):
+        self.Exporter.File.Write("AnimLinkName {{ \"{}\"; }}\n" .format(self.SafeName))
 
-    # "Protected" Interface
     def _MatrixCompute(self):
         # compute the new matrix_local
         if self.Parent:
@@ -115,8 +136,8 @@ class ExportObject:  # Base class, do not use
 
         # write the attachpoint tag if present
         if self.type != 'BONE':
-            if self.BlenderObject.fsx_xml:
-                PartData = self.BlenderObject.fsx_xml
+            PartData = self._PartData()
+            if PartData:
                 self.Exporter.File.Write("PartData {\n")
                 self.Exporter.File.Indent()
                 self.Exporter.File.Write("%i;\n" % (len(PartData) + 1))
@@ -137,15 +158,14 @@ class ExportObject:  # Base class, do not use
         self.Exporter.File.Unindent()
         self.Exporter.File.Write("}\n")
 
+    # Attachpoint data of the frame
+    def _PartData(self):
+        return self.BlenderObject.fsx_xml
+
     def _CloseFrame(self):
         self.Exporter.File.Unindent()
         self.Exporter.File.Write("}} // End of frm-{}\n".format(self.SafeName))
 
-    def _WriteChildren(self):
-        for Child in Util.SortByNameField(self.Children):
-            self.Exporter.log.log("Writing information of %s" % Child.name, True, True)
-            Child.Write()
-
 
 # Simple decorator implemenation for ExportObject.  Used by empty objects
 class EmptyExportObject(ExportObject):
@@ -164,86 +184,206 @@ class MeshExportObject(ExportObject):
         ExportObject.__init__(self, config, Exporter, BlenderObject)
 
         self.type = 'MESH'
+        self.ShareKey = None
+        # Mesh data extracted in advance (for instanced geometry)
+        self.Data = None
 
     def __repr__(self):
         return "[MeshExportObject: {}]".format(self.name)
 
-    # "Public" Interface
+    # "Protected" Interface
 
-    def Write(self):  # TODO - optimize! too slow...
-        self._OpenFrame()
+    def _WriteContent(self):
+        self.ShareKey = self.__ShareKey()
+        if not (self.__WriteSharedMesh() or self.__WriteUnchangedMesh()):
+            self.__WriteEvaluatedMesh()
+        self.Exporter.File.Write("AnimLinkName {{ \"{}\"; }}\n" .format(self.SafeName))
 
-        self.Exporter.log.log(" * Generating mesh for export...", True, True)
-        # Generate the export mesh
-        Mesh = None
-        ob_eval = None
-        if self.config.ApplyModifiers:
-            # Certain modifiers shouldn't be applied in some cases
-            # Deactivate them until after mesh generation is complete
-
-            DeactivatedModifierList = []
-
-            # If we're exporting armature data, we shouldn't apply
-            # armature modifiers to the mesh
-            if self.config.ExportSkinWeights:
-                DeactivatedModifierList = [Modifier
-                                           for Modifier in self.BlenderObject.modifiers
-                                           if Modifier.type == 'ARMATURE' and Modifier.show_viewport]
-
-            for Modifier in DeactivatedModifierList:
-                Modifier.show_viewport = False
-
-            depsgraph = self.Exporter.context.evaluated_depsgraph_get()
-            ob_eval = self.BlenderObject.evaluated_get(depsgraph)
-            Mesh = ob_eval.to_mesh()
-
-            # Restore the deactivated modifiers
-            for Modifier in DeactivatedModifierList:
-                Modifier.show_viewport = True
+        self.Exporter.log.log(" * Processing children...", True, True)
+
+    # Linked duplicates (objects using the same mesh, with the same modifiers
+    # and materials) have the same Mesh body, which is serialized once and
+    # spliced in for each of them; only their frames differ.  Modifiers
+    # depending on another object, which geometry nodes may do, make the
+    # body depend on where the object is, so such objects are not shared.
+    # Neither are skinned objects when skin weights are exported: their skin
+    # weights hold the offset of each bone from the object.
+    # Returns None for an object that is not shared.
+    def __ShareKey(self):
+        # Instanced geometry extracted once is shared by all its instances
+        if self.Data is not None:
+            return repr((id(self.Data), self.Exporter.File.Indentation))
+
+        Object = self.BlenderObject
+        if self.Exporter.MeshUsers[Object.data] < 2:
+            return None
+
+        for Modifier in Object.modifiers:
+            if Modifier.type == 'NODES':
+                return None
+            if Modifier.type == 'ARMATURE' and self.config.ExportSkinWeights:
+                return None
+            if getattr(Modifier, "object", None) is not None:
+                return None
+
+        return repr((Object.data.name_full,
+                     [Slot.material.name_full if Slot.material is not None else None
+                      for Slot in Object.material_slots],
+                     ModifierSignature(Object), self.Exporter.File.Indentation))
+
+    def __WriteSharedMesh(self):
+        if self.ShareKey not in self.Exporter.SharedMeshes:
+            return False
+
+        Chunk, Key = self.Exporter.SharedMeshes[self.ShareKey]
+        self.Exporter.log.log(" * Linked duplicate, mesh body of an earlier object reused", True, True)
+        self.Exporter.File.WriteChunk(Chunk, self.SafeName)
+        if Key is not None:
+            self.Exporter.ChunkKeys[self.name, self.Exporter.File.Indentation] = Key
+        self.Exporter.SharedMeshCount += 1
+        self.Exporter.SharedMeshSize += len(Chunk)
+        return True
+
+    # Writes the Mesh body of Data to the file, and returns it as a chunk
+    def __CaptureMesh(self, Data):
+        self.Exporter.File.BeginCapture()
+        self.__WriteMesh(Data, self.Exporter.File.ChunkName)
+        return self.Exporter.File.EndCapture()
+
+    # With an incremental export, an object for which nothing changed since
+    # the last export is spliced from the chunk cache without evaluating it.
+    # Chunks are recorded by object name and indentation, which is part of
+    # their key.  Returns False if it has to be written.
+    def __WriteUnchangedMesh(self):
+        Cache = self.Exporter.ChunkCache
+        Changes = self.Exporter.Changes
+        Recorded = (self.name, self.Exporter.File.Indentation)
+        if Cache is None or Changes is None or Recorded not in Changes.ChunkKeys:
+            return False
+
+        # The skin weights also depend on the armatures and on the frame
+        # names of the bones, which the change record does not cover.  The
+        # key of a skinned mesh is worked out from scratch.
+        Object = self.BlenderObject
+        if self.config.ExportSkinWeights and any(Modifier.type == 'ARMATURE' for Modifier in Object.modifiers):
+            return False
+
+        if not Changes.IsClean(Object, Object.data,
+                               *[Slot.material for Slot in Object.material_slots],
+                               *[getattr(Modifier, "object", None) for Modifier in Object.modifiers]):
+            return False
+
+        Key = Changes.ChunkKeys[Recorded]
+        Chunk = Cache.Get(Key)
+        if Chunk is None:
+            return False
+
+        self.Exporter.log.log(" * Unchanged since the last export, mesh taken from the chunk cache", True, True)
+        self.Exporter.File.WriteChunk(Chunk, self.SafeName)
+        self.Exporter.ChunkKeys[Recorded] = Key
+        if self.ShareKey is not None:
+            self.Exporter.SharedMeshes[self.ShareKey] = (Chunk, Key)
+        return True
+
+    def __WriteEvaluatedMesh(self):
+        if self.Data is not None:
+            Data = self.Data
         else:
-            depsgraph = self.Exporter.context.evaluated_depsgraph_get()
-            ob_eval = self.BlenderObject.evaluated_get(depsgraph)
-            Mesh = ob_eval.to_mesh()
+            Data = self.__EvaluateMesh()
+
+        # Splice the serialized mesh from the chunk cache if nothing that
+        # goes into it changed since it was stored.  Chunks for the cache or
+        # for linked duplicates are captured with a placeholder name.
+        Cache = self.Exporter.ChunkCache
+        Key = None
+        if Cache is not None:
+            Key = Cache.Key(Data.Digest(), self.Exporter.File.Indentation,
+                            [MaterialSignature(Material) for Material in Data.Materials],
+                            ModifierSignature(self.BlenderObject),
+                            SkinSignature(self.BlenderObject, self.Exporter.FrameNames)
+                            if self.config.ExportSkinWeights else None)
+            Chunk = Cache.Get(Key)
+            if Chunk is not None:
+                self.Exporter.log.log(" * Mesh taken from the chunk cache", True, True)
+            else:
+                Chunk = self.__CaptureMesh(Data)
+                Cache.Put(Key, Chunk)
+            self.Exporter.ChunkKeys[self.name, self.Exporter.File.Indentation] = Key
+        elif self.ShareKey is not None:
+            Chunk = self.__CaptureMesh(Data)
+        else:
+            Chunk = None
+            self.__WriteMesh(Data, self.SafeName)
 
-        # process virtual cockpit textures
-        # process nNumber texture ??? - missing
-        vctextures = []
+        if Chunk is not None:
+            self.Exporter.File.WriteChunk(Chunk, self.SafeName)
+            if self.ShareKey is not None:
+                self.Exporter.SharedMeshes[self.ShareKey] = (Chunk, Key)
 
-        for index, mat in enumerate(Mesh.materials):
-            if mat is not None:
-                #if mat.fsxm_vcpaneltex or mat.fsxm_nnumbertex:
-                if mat.fsxm_vcpaneltex:
-                    vctextures.append(index)
+    # Evaluates the object and extracts the data to write from its mesh
+    def __EvaluateMesh(self):
+        self.Exporter.log.log(" * Generating mesh for export...", True, True)
+        # Generate the export mesh.  The armature modifiers that must not be
+        # applied were switched off by the exporter before it evaluated the
+        # depsgraph.
+        ob_eval = self.BlenderObject.evaluated_get(self.Exporter.Depsgraph)
+        Mesh = ob_eval.to_mesh()
+
+        Data = MeshExportObject._ExtractTriangulatedMeshData(self.config, Mesh)
 
-        if len(vctextures) > 0:
-            for poly in Mesh.polygons:
-                if poly.material_index in vctextures:
-                    for uv_layer in Mesh.uv_layers:
-                        for index in poly.loop_indices:
-                            v = uv_layer.data[index].uv[1]
-                            uv_layer.data[index].uv[1] = 1 - v
-        del vctextures
+        # Cleanup
+        # deprecated.
+        # bpy.data.meshes.remove(Mesh)
+        # new routine:
+        ob_eval.to_mesh_clear()
+        return Data
+
+    # Triangulates the mesh's faces, or XToMdl will raise warnings, and pulls
+    # the mesh data out.  The loop triangles are read along with the rest of
+    # the mesh data, the bmesh round trip is kept as a fallback.  It changes
+    # Mesh, unless Temporary is set: the geometry of instances belongs to the
+    # depsgraph, so it is triangulated in a temporary mesh.
+    @staticmethod
+    def _ExtractTriangulatedMeshData(config, Mesh, Temporary=False):
+        Triangulate = config.Triangulation == 'LOOPTRIS'
+        if Triangulate or IsTriangulated(Mesh):
+            return MeshExportObject._ExtractMeshData(config, Mesh, Triangulate)
 
-        # triangulate the mesh's faces, or XToMdl will raise warnings
         import bmesh
         bm = bmesh.new()
         bm.from_mesh(Mesh)
         bmesh.ops.triangulate(bm, faces=bm.faces)
-        bm.to_mesh(Mesh)
+        Target = Mesh
+        if Temporary:
+            Target = bpy.data.meshes.new(Mesh.name)
+            for Material in Mesh.materials:
+                Target.materials.append(Material)
+        bm.to_mesh(Target)
         bm.free()
 
-        self.__WriteMesh(Mesh)
+        try:
+            return MeshExportObject._ExtractMeshData(config, Target, False)
+        finally:
+            if Target is not Mesh:
+                bpy.data.meshes.remove(Target)
 
-        # Cleanup
-        # deprecated.
-        # bpy.data.meshes.remove(Mesh)
-        # new routine:
-        ob_eval.to_mesh_clear()
+    # Pulls everything the writers need out of an evaluated mesh, in bulk
+    @staticmethod
+    def _ExtractMeshData(config, Mesh, Triangulate):
+        Data = MeshData(Mesh, config.ExportSkinWeights, Triangulate)
 
-        self.Exporter.log.log(" * Processing children...", True, True)
-        self._WriteChildren()
+        # process virtual cockpit textures
+        # process nNumber texture ??? - missing
+        vctextures = []
 
-        self._CloseFrame()
+        for index, mat in enumerate(Data.Materials):
+            if mat is not None:
+                #if mat.fsxm_vcpaneltex or mat.fsxm_nnumbertex:
+                if mat.fsxm_vcpaneltex:
+                    vctextures.append(index)
+
+        Data.FlipV(vctextures)
+        return Data
 
     ###########################################################################
     # "Protected"
@@ -253,270 +393,209 @@ class MeshExportObject(ExportObject):
     # vertex of each face, some can reuse vertex data.  For those we'd use
     # _UnrolledFacesMeshEnumerator and _OneToOneMeshEnumerator respectively.
     class _MeshEnumerator:
-        def __init__(self, Mesh):
-            self.Mesh = Mesh
+        def __init__(self, Data):
+            self.Data = Data
+
+            # self.vertices, self.PolygonVertexIndexes and
+            # self.PolygonVertexCounts relate to the MeshData in the
+            # following way:
 
-            # self.vertices and self.PolygonVertexIndexes relate to the
-            # original mesh in the following way:
+            # Data.LoopVertexIndexes[Data.CornerLoops[c]] ==
+            # self.vertices[self.PolygonVertexIndexes[c]]
 
-            # Mesh.vertices[Mesh.polygons[x].vertices[y]] ==
-            # self.vertices[self.PolygonVertexIndexes[x][y]]
+            # where c runs over the face corners polygon by polygon, and
+            # polygon x owns self.PolygonVertexCounts[x] of them.  All three
+            # are flat index arrays, so no per corner objects are kept.
 
             self.vertices = None
             self.PolygonVertexIndexes = None
+            self.PolygonVertexCounts = Data.PolygonLoopTotals
+
+            # For enumerators that split vertices per face corner,
+            # self.Corners[i] is the face corner exported vertex i stands
+            # for, which is where its UV coordinates come from.
+
+            self.Corners = None
 
     # Represents the mesh as it is inside Blender
     class _OneToOneMeshEnumerator(_MeshEnumerator):
-        def __init__(self, Mesh):
-            MeshExportObject._MeshEnumerator.__init__(self, Mesh)
-
-            self.vertices = Mesh.vertices
+        def __init__(self, Data):
+            MeshExportObject._MeshEnumerator.__init__(self, Data)
 
-            self.PolygonVertexIndexes = tuple(tuple(Polygon.vertices)
-                                              for Polygon in Mesh.polygons)
+            self.vertices = np.arange(Data.VertexCount)
+            self.PolygonVertexIndexes = Data.LoopVertexIndexes[Data.CornerLoops]
 
-    # Duplicates each vertex for each face
+    # Duplicates each vertex for each face.  The exported vertex c is face
+    # corner c, so the loop->vertex index array is all we need to keep; the
+    # skin weight writer uses it to look up the weights of the original
+    # vertex.
     class _UnrolledFacesMeshEnumerator(_MeshEnumerator):
-        def __init__(self, Mesh):
-            MeshExportObject._MeshEnumerator.__init__(self, Mesh)
-
-            self.vertices = tuple()
-            for Polygon in Mesh.polygons:
-                self.vertices += tuple(Mesh.vertices[VertexIndex]
-                                       for VertexIndex in Polygon.vertices)
-
-            self.PolygonVertexIndexes = []
-            Index = 0
-            for Polygon in Mesh.polygons:
-                self.PolygonVertexIndexes.append(tuple(range(Index,
-                                                 Index + len(Polygon.vertices))))
-                Index += len(Polygon.vertices)
+        def __init__(self, Data):
+            MeshExportObject._MeshEnumerator.__init__(self, Data)
+
+            self.vertices = Data.LoopVertexIndexes[Data.CornerLoops]
+            self.PolygonVertexIndexes = np.arange(len(Data.CornerLoops))
+            self.Corners = self.PolygonVertexIndexes
+
+    # Like _UnrolledFacesMeshEnumerator, but face corners that would export
+    # as identical vertices share one.  NormalEnumerator supplies the normal
+    # of each corner.
+    class _WeldedFacesMeshEnumerator(_MeshEnumerator):
+        def __init__(self, Data, NormalEnumerator, Skinned):
+            MeshExportObject._MeshEnumerator.__init__(self, Data)
+
+            self.Corners, self.PolygonVertexIndexes = Data.Weld(
+                NormalEnumerator.PolygonVertexIndexes, Skinned)
+            self.vertices = Data.LoopVertexIndexes[Data.CornerLoops[self.Corners]]
+
+    # Since mesh normals only need their face counts and vertices per face
+    # to match up with the other mesh data, we can optimize export with
+    # this enumerator.  Exports each vertex's normal when a face is shaded
+    # smooth, and exports the face normal only once when a face is shaded
+    # flat.  Here self.vertices holds the normals themselves.
+    class _NormalsMeshEnumerator(_MeshEnumerator):
+        def __init__(self, Data, Tolerance):
+            MeshExportObject._MeshEnumerator.__init__(self, Data)
+
+            self.vertices, self.PolygonVertexIndexes = Data.GatherNormals(Tolerance)
 
     ###########################################################################
     # "Private" Methods
 
-    def __WriteMesh(self, Mesh):
+    def __WriteMesh(self, Data, Name):
         self.Exporter.log.log(" * Writing vertices...", True, True)
 
-        self.Exporter.File.Write("Mesh {{ // {} mesh\n".format(self.SafeName))
+        self.Exporter.File.Write("Mesh {{ // {} mesh\n".format(Name))
         self.Exporter.File.Indent()
 
+        NormalEnumerator = MeshExportObject._NormalsMeshEnumerator(
+            Data, self.config.NormalTolerance)
+
         # Create the mesh enumerator based on options
         MeshEnumerator = None
-        if Mesh.uv_layers or self.config.ExportSkinWeights:
-            MeshEnumerator = MeshExportObject._UnrolledFacesMeshEnumerator(Mesh)
+        if Data.UVLayers or self.config.ExportSkinWeights:
+            if self.config.WeldVertices:
+                MeshEnumerator = MeshExportObject._WeldedFacesMeshEnumerator(
+                    Data, NormalEnumerator, self.config.ExportSkinWeights)
+                self.Exporter.log.log("   Welded {} face corners into {} vertices".format(
+                    len(Data.CornerLoops), len(MeshEnumerator.vertices)), True)
+            else:
+                MeshEnumerator = MeshExportObject._UnrolledFacesMeshEnumerator(Data)
         else:
-            MeshEnumerator = MeshExportObject._OneToOneMeshEnumerator(Mesh)
+            MeshEnumerator = MeshExportObject._OneToOneMeshEnumerator(Data)
 
         # Write vertex positions
         VertexCount = len(MeshEnumerator.vertices)
         self.Exporter.File.Write("{};\n".format(VertexCount))
-        for Index, Vertex in enumerate(MeshEnumerator.vertices):
-            Position = Vertex.co
-            self.Exporter.File.Write("{:9f};{:9f};{:9f};".format(
-                                     Position[0], Position[1], Position[2]))
+        self.Exporter.File.WriteArray(Data.Positions[MeshEnumerator.vertices])
 
-            if Index == VertexCount - 1:
-                self.Exporter.File.Write(";\n", Indent=False)
-            else:
-                self.Exporter.File.Write(",\n", Indent=False)
-
-        # Write face definitions
-        PolygonCount = len(MeshEnumerator.PolygonVertexIndexes)
+        # Write face definitions, reversing the winding order
+        PolygonCount = len(MeshEnumerator.PolygonVertexCounts)
         self.Exporter.File.Write("{};\n".format(PolygonCount))
-        for Index, PolygonVertexIndexes in \
-                enumerate(MeshEnumerator.PolygonVertexIndexes):
-
-            self.Exporter.File.Write("{};".format(len(PolygonVertexIndexes)))
-
-            PolygonVertexIndexes = PolygonVertexIndexes[::-1]
-
-            for VertexCountIndex, VertexIndex in \
-                    enumerate(PolygonVertexIndexes):
-
-                if VertexCountIndex == len(PolygonVertexIndexes) - 1:
-                    self.Exporter.File.Write("{};".format(VertexIndex),
-                                             Indent=False)
-                else:
-                    self.Exporter.File.Write("{},".format(VertexIndex),
-                                             Indent=False)
-
-            if Index == PolygonCount - 1:
-                self.Exporter.File.Write(";\n", Indent=False)
-            else:
-                self.Exporter.File.Write(",\n", Indent=False)
+        self.Exporter.File.WriteIndexArray(
+            MeshEnumerator.PolygonVertexCounts,
+            ReverseRows(MeshEnumerator.PolygonVertexCounts, MeshEnumerator.PolygonVertexIndexes))
 
         # Write the other mesh components
 
         self.Exporter.log.log(" * Writing normals...", True, True)
-        self.__WriteMeshNormals(Mesh)
+        self.__WriteMeshNormals(Data, Name, NormalEnumerator)
 
         self.Exporter.log.log(" * Writing UV coordinates...", True, True)
-        self.__WriteMeshUVCoordinates(Mesh)
+        self.__WriteMeshUVCoordinates(Data, Name, MeshEnumerator)
         if ((bpy.context.scene.global_sdk == 'p3dv4') or (bpy.context.scene.global_sdk == 'p3dv5') or (bpy.context.scene.global_sdk == 'p3dv6')):
-            self.__WriteMeshUVCoordinates2(Mesh)
+            self.__WriteMeshUVCoordinates2(Data, Name, MeshEnumerator)
 
         self.Exporter.log.log(" * Writing materials...", True, True)
-        self.__WriteMeshMaterials(Mesh=Mesh)
+        self.__WriteMeshMaterials(Data=Data, Name=Name)
 
         if self.config.ExportSkinWeights:
             self.Exporter.log.log(" * Writing mesh skin weights...", True, True)
-            self.__WriteMeshSkinWeights(Mesh=Mesh, MeshEnumerator=MeshEnumerator)
+            self.__WriteMeshSkinWeights(Data=Data, MeshEnumerator=MeshEnumerator)
 
         self.Exporter.File.Unindent()
-        self.Exporter.File.Write("}} // End of {} mesh\n".format(self.SafeName))
-        self.Exporter.File.Write("AnimLinkName {{ \"{}\"; }}\n" .format(self.SafeName))
+        self.Exporter.File.Write("}} // End of {} mesh\n".format(Name))
 
-    def __WriteMeshNormals(self, Mesh, MeshEnumerator=None):
-
-        # Since mesh normals only need their face counts and vertices per face
-        # to match up with the other mesh data, we can optimize export with
-        # this enumerator.  Exports each vertex's normal when a face is shaded
-        # smooth, and exports the face normal only once when a face is shaded
-        # flat.
-        class _NormalsMeshEnumerator(MeshExportObject._MeshEnumerator):
-            def __init__(self, Mesh):
-                MeshExportObject._MeshEnumerator(Mesh)
-
-                self.vertices = []
-                self.PolygonVertexIndexes = []
-
-                Index = 0
-                for Polygon in Mesh.polygons:
-                    if not Polygon.use_smooth:
-                        self.vertices.append(Polygon.normal)
-                        self.PolygonVertexIndexes.append(
-                            tuple(3 * [Index]))
-                        Index += 1
-                    else:
-                        indices = []
-                        for VertexIndex in Polygon.vertices:
-                            candidate = Mesh.vertices[VertexIndex].normal
-                            if candidate in self.vertices:
-                                indices.append(self.vertices.index(candidate))
-                            else:
-                                self.vertices.append(candidate)
-                                indices.append(len(self.vertices) - 1)
-                                Index += 1
-                        self.PolygonVertexIndexes.append(
-                            tuple(indices))
+    def __WriteMeshNormals(self, Data, Name, MeshEnumerator=None):
 
         if MeshEnumerator is None:
-            MeshEnumerator = _NormalsMeshEnumerator(Mesh)
+            MeshEnumerator = MeshExportObject._NormalsMeshEnumerator(
+                Data, self.config.NormalTolerance)
 
         self.Exporter.File.Write("MeshNormals {{ // {} normals\n".format(
-            self.SafeName))
+            Name))
         self.Exporter.File.Indent()
 
         # Write mesh normals.
         NormalCount = len(MeshEnumerator.vertices)
         self.Exporter.File.Write("{};\n".format(NormalCount))
 
-        for Index, Vertex in enumerate(MeshEnumerator.vertices):
-            Normal = Vertex
-
-            self.Exporter.File.Write("{:9f};{:9f};{:9f};".format(Normal[0],
-                                     Normal[1], Normal[2]))
-
-            if Index == NormalCount - 1:
-                self.Exporter.File.Write(";\n", Indent=False)
-            else:
-                self.Exporter.File.Write(",\n", Indent=False)
+        self.Exporter.File.WriteArray(MeshEnumerator.vertices)
 
-        # Write face definitions.
-        FaceCount = len(MeshEnumerator.PolygonVertexIndexes)
+        # Write face definitions, reversing the winding order
+        FaceCount = len(MeshEnumerator.PolygonVertexCounts)
         self.Exporter.File.Write("{};\n".format(FaceCount))
-
-        for Index, Polygon in enumerate(MeshEnumerator.PolygonVertexIndexes):
-            # Reverse the winding order
-            self.Exporter.File.Write("3;{},{},{};" .format(Polygon[2], Polygon[1], Polygon[0]))
-
-            if Index == FaceCount - 1:
-                self.Exporter.File.Write(";\n", Indent=False)
-            else:
-                self.Exporter.File.Write(",\n", Indent=False)
+        self.Exporter.File.WriteIndexArray(
+            MeshEnumerator.PolygonVertexCounts,
+            ReverseRows(MeshEnumerator.PolygonVertexCounts, MeshEnumerator.PolygonVertexIndexes))
 
         self.Exporter.File.Unindent()
         self.Exporter.File.Write("}} // End of {} normals\n".format(
-            self.SafeName))
-
-    def __WriteMeshUVCoordinates(self, Mesh):
-        if not Mesh.uv_layers or len(Mesh.uv_layers) <= 0:
+            Name))
+
+    # Gathers the UV coordinates of one layer for the face corners the
+    # exported vertices stand for, in the order MeshEnumerator lays them out.
+    # V is flipped to the DirectX convention (in double precision, like the
+    # writers always did).
+    def __GatherUVCoordinates(self, Data, Layer, MeshEnumerator):
+        Coordinates = Data.UVLayers[Layer][Data.CornerLoops[MeshEnumerator.Corners]].astype(np.float64)
+        Coordinates[:, 1] = 1.0 - Coordinates[:, 1]
+        return Coordinates
+
+    def __WriteMeshUVCoordinates(self, Data, Name, MeshEnumerator):
+        if not Data.UVLayers or len(Data.UVLayers) <= 0:
             return
 
         self.Exporter.File.Write("MeshTextureCoords {{ // {} UV coordinates\n"
-                                 .format(self.SafeName))
+                                 .format(Name))
         self.Exporter.File.Indent()
 
-        UVCoordinates = Mesh.uv_layers[0].data
-
-        VertexCount = 0
-        for Polygon in Mesh.polygons:
-            VertexCount += len(Polygon.vertices)
+        Vertices = self.__GatherUVCoordinates(Data, 0, MeshEnumerator)
+        VertexCount = len(Vertices)
 
-        # Gather and write UV coordinates
-        Index = 0
+        # Write UV coordinates
         self.Exporter.File.Write("{};\n".format(VertexCount))
-        for Polygon in Mesh.polygons:
-            Vertices = []
-            for Vertex in [UVCoordinates[Vertex] for Vertex in
-                           Polygon.loop_indices]:
-                Vertices.append(tuple(Vertex.uv))
-            for Vertex in Vertices:
-                self.Exporter.File.Write("{:9f};{:9f};".format(Vertex[0],
-                                         1.0 - Vertex[1]))
-                Index += 1
-                if Index == VertexCount:
-                    self.Exporter.File.Write(";\n", Indent=False)
-                else:
-                    self.Exporter.File.Write(",\n", Indent=False)
+        self.Exporter.File.WriteArray(Vertices)
 
         self.Exporter.File.Unindent()
         self.Exporter.File.Write("}} // End of {} UV coordinates\n".format(
-            self.SafeName))
+            Name))
 
     # uv coords of the second UV channel
-    def __WriteMeshUVCoordinates2(self, Mesh):
-        if not Mesh.uv_layers or len(Mesh.uv_layers) <= 1:
+    def __WriteMeshUVCoordinates2(self, Data, Name, MeshEnumerator):
+        if not Data.UVLayers or len(Data.UVLayers) <= 1:
             return
         print("__WriteMeshUVCoordinates2 - found")
 
         self.Exporter.File.Write("MeshTextureCoords2 {{ // {} UV coordinates, channel 2\n"
-                                 .format(self.SafeName))
+                                 .format(Name))
         self.Exporter.File.Indent()
 
-        UVCoordinates = Mesh.uv_layers[1].data
-        print("__WriteMeshUVCoordinates2 - data", UVCoordinates)
-
-        VertexCount = 0
-        for Polygon in Mesh.polygons:
-            VertexCount += len(Polygon.vertices)
+        Vertices = self.__GatherUVCoordinates(Data, 1, MeshEnumerator)
+        VertexCount = len(Vertices)
 
-        # Gather and write UV coordinates
-        Index = 0
+        # Write UV coordinates
         self.Exporter.File.Write("{};\n".format(VertexCount))
-        for Polygon in Mesh.polygons:
-            Vertices = []
-            for Vertex in [UVCoordinates[Vertex] for Vertex in
-                           Polygon.loop_indices]:
-                Vertices.append(tuple(Vertex.uv))
-            for Vertex in Vertices:
-                self.Exporter.File.Write("{:9f};{:9f};".format(Vertex[0],
-                                         1.0 - Vertex[1]))
-                Index += 1
-                if Index == VertexCount:
-                    self.Exporter.File.Write(";\n", Indent=False)
-                else:
-                    self.Exporter.File.Write(",\n", Indent=False)
+        self.Exporter.File.WriteArray(Vertices)
 
         self.Exporter.File.Unindent()
         self.Exporter.File.Write("}} // End of {} UV 2 coordinates\n".format(
-            self.SafeName))
+            Name))
 
     ###########################################################################
     # Here's the function that caused the looooong wait for the Blender 2.8x update. ON
 
-    def __WriteMeshMaterials(self, Mesh):
+    def __WriteMeshMaterials(self, Data, Name):
 
         # the following function writes the material to file
         def WriteMaterial(self, Exporter, Material):
@@ -1123,41 +1202,40 @@ class MeshExportObject(ExportObject):
                 Exporter.File.Write("} // End of PBRMaterial\n")
 
         # gather object's materials
-        Materials = Mesh.materials
+        Materials = Data.Materials
         # Do not write materials if there are none
-        if not Materials.keys():
+        if not any(Material is not None for Material in Materials):
             return
 
-        print(" Mesh", Mesh.name)
+        print(" Mesh", Data.name)
         self.Exporter.File.Write("MeshMaterialList {{ // {} material list\n".
-                                 format(self.SafeName))
+                                 format(Name))
         self.Exporter.File.Indent()
 
+        PolygonCount = Data.PolygonCount
         self.Exporter.File.Write("{};\n".format(len(Materials)))
-        self.Exporter.File.Write("{};\n".format(len(Mesh.polygons)))
+        self.Exporter.File.Write("{};\n".format(PolygonCount))
 
         # Write a material index for each face
-        for Index, Polygon in enumerate(Mesh.polygons):
-            self.Exporter.File.Write("{}".format(Polygon.material_index))
-            if Index == len(Mesh.polygons) - 1:
-                self.Exporter.File.Write(";\n", Indent=False)
-            else:
-                self.Exporter.File.Write(",\n", Indent=False)
+        self.Exporter.File.WriteArray(Data.PolygonMaterialIndexes, Format="%d",
+                                      RowSeparator=",", Terminator=";")
 
         for Material in Materials:
             WriteMaterial(self, self.Exporter, Material)
 
         self.Exporter.File.Unindent()
-        self.Exporter.File.Write("}} // End of {} material list\n".format(self.SafeName))
+        self.Exporter.File.Write("}} // End of {} material list\n".format(Name))
 
-    def __WriteMeshSkinWeights(self, Mesh, MeshEnumerator=None):
+    def __WriteMeshSkinWeights(self, Data, MeshEnumerator=None):
         # This contains vertex indexes and weights for the vertices that belong
         # to this bone's group.  Also calculates the bone skin matrix.
+        FrameNames = self.Exporter.FrameNames
+
         class _BoneVertexGroup:
             def __init__(self, BlenderObject, ArmatureObject, BoneName):
                 self.BoneName = BoneName
-                self.SafeName = Util.SafeName(ArmatureObject.name) + "_" + \
-                    Util.SafeName(BoneName)
+                self.SafeName = FrameNames.Get(ArmatureObject.data.bones[BoneName],
+                                               Util.SafeName(ArmatureObject.name) + "_" + Util.SafeName(BoneName))
 
                 self.Indexes = []
                 self.Weights = []
@@ -1184,11 +1262,14 @@ class MeshExportObject(ExportObject):
         # Skin weights work well with vertex reuse per face.  Use a
         # _OneToOneMeshEnumerator if possible.
         if MeshEnumerator is None:
-            MeshEnumerator = MeshExportObject._UnrolledFacesMeshEnumerator(Mesh)
+            MeshEnumerator = MeshExportObject._UnrolledFacesMeshEnumerator(Data)
 
+        # Modifiers the exporter switched off count as enabled
+        DisabledModifiers = self.Exporter.DisabledModifiers.get(self.BlenderObject, ())
         ArmatureModifierList = [Modifier
                                 for Modifier in self.BlenderObject.modifiers
-                                if Modifier.type == 'ARMATURE' and Modifier.show_viewport]
+                                if Modifier.type == 'ARMATURE'
+                                and (Modifier.show_viewport or Modifier.name in DisabledModifiers)]
 
         if not ArmatureModifierList:
             return
@@ -1209,79 +1290,74 @@ class MeshExportObject(ExportObject):
                 BoneVertexGroups = [_BoneVertexGroup(self.BlenderObject,
                                     ArmatureObject, BoneName) for BoneName in UsedBoneNames]
 
-                # Maps Blender's internal group indexing to our _BoneVertexGroups
-                GroupIndexToBoneVertexGroups = {Group.index: BoneVertexGroup
-                                                for Group in self.BlenderObject.vertex_groups
-                                                for BoneVertexGroup in BoneVertexGroups
-                                                if Group.name == BoneVertexGroup.BoneName}
-
                 MaximumInfluences = 4
 
+                # Maps Blender's internal group indexing to our _BoneVertexGroups
+                BoneIndexes = {BoneVertexGroup.BoneName: Bone
+                               for Bone, BoneVertexGroup in enumerate(BoneVertexGroups)}
+                GroupBones = np.full(len(self.BlenderObject.vertex_groups), -1, dtype=np.int32)
+                for Group in self.BlenderObject.vertex_groups:
+                    GroupBones[Group.index] = BoneIndexes.get(Group.name, -1)
+
+                # The influences are worked out once per mesh vertex, all
+                # vertices at once, and the text of each vertex is shared by
+                # all the corners written for it.
+                Counts, Bones, Weights = Data.SkinInfluences(GroupBones, MaximumInfluences,
+                                                             self.config.SkinWeightThreshold)
+                Names = [BoneVertexGroup.SafeName for BoneVertexGroup in BoneVertexGroups]
+
                 self.Exporter.File.Write("MeshSkinWeights {\n")
                 self.Exporter.File.Write("%i;\n" % len(MeshEnumerator.vertices))
                 self.Exporter.File.Indent()
+                VertexPrefix = self.Exporter.File.Indentation
+                self.Exporter.File.Indent()
+                InfluencePrefix = self.Exporter.File.Indentation
+                self.Exporter.File.Unindent()
 
-                for Index, Vertex in enumerate(MeshEnumerator.vertices):
-                    VertexWeightTotal = 0.0
-                    VertexInfluences = 0
-                    relVertexGroups = []
-
-                    # Sum up the weights of groups that correspond
-                    # to armature bones.
-                    for VertexGroup in Vertex.groups:
-                        BoneVertexGroup = GroupIndexToBoneVertexGroups.get(VertexGroup.group)
-                        if BoneVertexGroup is not None:
-                            relVertexGroups.append(VertexGroup)
-                            VertexWeightTotal += VertexGroup.weight
-                            VertexInfluences += 1
-
-                    # bubble sort to go through the vertex group:
-                    def groupSort(myVertexGroup):
-                        if myVertexGroup is None:
-                            return
-
-                        n = len(myVertexGroup)
-
-                        # Traverse through all array elements
-                        for i in range(n):
-
-                            # Last i elements are already in place
-                            for j in range(0, n - i - 1):
-
-                                # traverse the array from 0 to n-i-1
-                                # Swap if the element found is greater
-                                # than the next element
-                                if myVertexGroup[j].weight <= myVertexGroup[j + 1].weight:
-                                    myVertexGroup[j], myVertexGroup[j + 1] = myVertexGroup[j + 1], myVertexGroup[j]
-
-                    # Let's make the weights a bit smarter. ON.
-                    if (VertexInfluences > MaximumInfluences) and (len(relVertexGroups) > 0):
-                        groupSort(relVertexGroups)
-                        relVertexGroups = relVertexGroups[:MaximumInfluences]
-
-                    # Write the weights to file
-                    # normalizing each bone's weight.
-                    self.Exporter.File.Write("{};\n".format(len(relVertexGroups)))  # VertexInfluences))
-                    self.Exporter.File.Indent()
-
-                    for VertexGroup in relVertexGroups:
-                        BoneVertexGroup = GroupIndexToBoneVertexGroups.get(VertexGroup.group)
-                        if BoneVertexGroup is not None:
-                            self.Exporter.File.Write("\"{}\",".format(BoneVertexGroup.SafeName))
-                            if VertexWeightTotal > 0.0:     # added to catch divide by zero error. ON.
-                                self.Exporter.File.Write("{:9f};\n".format(VertexGroup.weight / VertexWeightTotal), Indent=False)
-                            else:
-                                self.Exporter.File.Write("{:9f};\n".format(0.0), Indent=False)
-                    if Vertex.groups is None:
-                        BoneVertexGroup = GroupIndexToBoneVertexGroups.get(0)
-                        self.Exporter.File.Write("\"{}\",".format(BoneVertexGroup.SafeName))
-                        self.Exporter.File.Write("{:9f};\n".format(0.0), Indent=False)
-                    self.Exporter.File.Unindent()
+                VertexTexts = ["{}{};\n".format(VertexPrefix, Count) +
+                               "".join("{}\"{}\",{};\n".format(InfluencePrefix, Names[Bone], Weight)
+                                       for Bone, Weight in zip(BoneRow[:Count], WeightRow[:Count]))
+                               for Count, BoneRow, WeightRow
+                               in zip(Counts.tolist(), Bones.tolist(), np.char.mod("%9f", Weights).tolist())]
+
+                Vertices = MeshEnumerator.vertices.tolist()
+                for Start in range(0, len(Vertices), 4096):
+                    self.Exporter.File.Write("".join([VertexTexts[VertexIndex]
+                                                      for VertexIndex in Vertices[Start:Start + 4096]]),
+                                             Indent=False)
 
                 self.Exporter.File.Unindent()
                 self.Exporter.File.Write("} // End MeshSkinWeights\n")
 
 
+# Mesh instance implementation of ExportObject: a copy of an object (or of
+# geometry) a collection instance or geometry nodes put in the scene, which
+# has no object of its own.  BlenderObject is the instanced object, or the
+# instancer for instanced geometry, whose mesh is extracted in advance as
+# Data.  Matrix_world is where the instance is; it becomes a child of its
+# instancer.
+class InstanceExportObject(MeshExportObject):
+    def __init__(self, config, Exporter, BlenderObject, Name, Matrix_world, Data=None):
+        MeshExportObject.__init__(self, config, Exporter, BlenderObject)
+
+        self.name = Name
+        self.SafeName = Util.SafeName(Name)
+        self.Matrix_world = Matrix_world
+        self.Data = Data
+
+    def __repr__(self):
+        return "[InstanceExportObject: {}]".format(self.name)
+
+    def _MatrixCompute(self):
+        self.Matrix_local = self.Parent.BlenderObject.matrix_world.inverted() @ self.Matrix_world
+
+    # The attachpoints of an instanced object are instanced with it
+    def _PartData(self):
+        if self.Data is not None:
+            return ""
+        return self.BlenderObject.fsx_xml
+
+
 # Armature object implementation of ExportObject
 class ArmatureExportObject(ExportObject):
     def __init__(self, config, Exporter, BlenderObject):
@@ -1292,12 +1368,13 @@ class ArmatureExportObject(ExportObject):
     def __repr__(self):
         return "[ArmatureExportObject: {}]".format(self.name)
 
-    # "Public" Interface
+    # "Protected" Interface
 
-    def Write(self):
+    def _OpenFrame(self):
         self.Exporter.log.log("Opening frame for {}".format(self), True, True)
-        self._OpenFrame()
+        ExportObject._OpenFrame(self)
 
+    def _WriteContent(self):
         Armature = self.BlenderObject.data
         RootBones = [Bone for Bone in Armature.bones if Bone.parent is None]
         print("Armature pose position", Armature.pose_position)
@@ -1307,9 +1384,9 @@ class ArmatureExportObject(ExportObject):
         self.Exporter.log.log("Done", False, True)
 
         self.Exporter.log.log("Writing children of {}".format(self), True, True)
-        self._WriteChildren()
 
-        self._CloseFrame()
+    def _CloseFrame(self):
+        ExportObject._CloseFrame(self)
         self.Exporter.log.log("Closed frame of {}".format(self), True, True)
 
         # IKChain for IKChain IK_MainHandle, IK_SecondaryHandle, IK_WheelsGroundLock needs to be done
@@ -1318,9 +1395,17 @@ class ArmatureExportObject(ExportObject):
     # "Private" Methods
 
     def __WriteBones(self, Bones):
-        # Simply export the frames for each bone.  Export in rest position or
-        # posed position depending on options.
-        for Bone in Bones:
+        # Simply export the frames for each bone, the frames of its children
+        # nested inside.  Export in rest position or posed position depending
+        # on options.
+        # Entries carrying a name close the frame of that name
+        Stack = [(Bone, None) for Bone in reversed(Bones)]
+        while Stack:
+            Bone, BoneSafeName = Stack.pop()
+            if BoneSafeName is not None:
+                self.__CloseBoneFrame(BoneSafeName)
+                continue
+
             BoneMatrix = Matrix()  # 4x4 identity matrix
 
             if self.config.ExportBonePosition == 'REST':
@@ -1333,13 +1418,11 @@ class ArmatureExportObject(ExportObject):
                     BoneMatrix = PoseBone.parent.matrix.inverted()
                 BoneMatrix *= PoseBone.matrix
 
-            BoneSafeName = self.SafeName + "_" + \
-                Util.SafeName(Bone.name)
+            BoneSafeName = self.Exporter.FrameNames.Get(Bone, self.SafeName + "_" + Util.SafeName(Bone.name))
             self.__OpenBoneFrame(BoneSafeName, BoneMatrix)
 
-            self.__WriteBoneChildren(Bone)
-
-            self.__CloseBoneFrame(BoneSafeName)
+            Stack.append((Bone, BoneSafeName))
+            Stack.extend((Child, None) for Child in reversed(Util.SortByNameField(Bone.children)))
 
     def __OpenBoneFrame(self, BoneSafeName, BoneMatrix):
         self.Exporter.File.Write("Frame frm-{} {{\n".format(BoneSafeName))
@@ -1369,9 +1452,6 @@ class ArmatureExportObject(ExportObject):
         self.Exporter.File.Unindent()
         self.Exporter.File.Write("}} // End of {}\n".format(BoneSafeName))
 
-    def __WriteBoneChildren(self, Bone):
-        self.__WriteBones(Util.SortByNameField(Bone.children))
-
 
 # Bone object implementation of ExportObject
 class BoneExportObject(ExportObject):
@@ -1386,24 +1466,20 @@ class BoneExportObject(ExportObject):
     def __repr__(self):
         return "[BoneExportObject: {}]".format(self.name)
 
-    # "Public" Interface
-    def Write(self):
-        self._Write(self)
-
     # "Protected" Methods
-    def _Write(self, Bone):
+    def _OpenFrame(self):
         self.Exporter.log.log("Opening frame for {}".format(self), False, True)
-        self._OpenFrame()
+        ExportObject._OpenFrame(self)
 
+    def _WriteContent(self):
         self.Exporter.log.log("Writing BoneInfo...", False, True)
         self.__WriteBone()
         self.Exporter.log.log("Done", False, True)
 
         self.Exporter.log.log("Writing children of {}".format(self), False, True)
-        self._WriteChildren()
-        self.Exporter.log.log("Done", False, True)
 
-        self._CloseFrame()
+    def _CloseFrame(self):
+        ExportObject._CloseFrame(self)
         self.Exporter.log.log("Close frame of {}".format(self), False, True)
 
     def _MatrixCompute(self):
@@ -1437,37 +1513,132 @@ class BoneExportObject(ExportObject):
         self.Exporter.File.Write("}\n")
 
 
-# Container for animation data
+# Container for animation data.  Each stream is a sorted array of frames
+# with one row per key: rotations as quaternions (w, x, y, z), positions as
+# vectors.
 class Animation:
     def __init__(self, SafeName):
         self.SafeName = SafeName
         self.AnimTag = None
         self.KeyRange = 0
 
-        self.RotationKeys = {}
-        self.PositionKeys = {}
+        self.RotationFrames = np.zeros(0, dtype=np.int64)
+        self.Rotations = np.zeros((0, 4))
+        self.PositionFrames = np.zeros(0, dtype=np.int64)
+        self.Positions = np.zeros((0, 3))
+
+    # Sets both streams from keys at Frames, in any order.  Frames are whole
+    # frames (the .xanim has no sub-frame times); the first key of a frame
+    # wins.  Rotations are made continuous, see func_keys.MakeContinuous.
+    def SetKeys(self, Frames, Rotations, Positions):
+        Frames, Indexes = np.unique(np.asarray(Frames, dtype=np.float64).astype(np.int64), return_index=True)
+        self.RotationFrames = Frames
+        self.Rotations = MakeContinuous(np.asarray(Rotations, dtype=np.float64).reshape(-1, 4)[Indexes])
+        self.PositionFrames = Frames.copy()
+        self.Positions = np.asarray(Positions, dtype=np.float64).reshape(-1, 3)[Indexes]
+
+    # Drops the keys that interpolating between the keys kept around them
+    # reproduces within the tolerances: linearly for positions, by slerp for
+    # rotations.  The first and last key of each stream are always kept.
+    # Returns the number of rotation and position keys before reduction.
+    def Reduce(self, PositionTolerance, RotationTolerance):
+        RotationCount = len(self.RotationFrames)
+        PositionCount = len(self.PositionFrames)
+
+        Kept = ReduceKeys(self.RotationFrames, self.Rotations, Slerp, QuaternionAngle, RotationTolerance)
+        self.RotationFrames, self.Rotations = self.RotationFrames[Kept], self.Rotations[Kept]
+        Kept = ReduceKeys(self.PositionFrames, self.Positions, Lerp, Distance, PositionTolerance)
+        self.PositionFrames, self.Positions = self.PositionFrames[Kept], self.Positions[Kept]
+        return RotationCount, PositionCount
+
+
+# Steps the timeline once for all the animation generators.  Each generator
+# asks for the matrices it needs at the frames it needs with Request(); Run()
+# then sets every requested frame once, in order, and records all of the
+# matrices asked for at that frame.  Setting a frame evaluates the whole
+# scene, so this is one evaluation per frame instead of one per frame and
+# animated part.
+class TimelineSampler:
+    def __init__(self, Scene):
+        self.Scene = Scene
+        self.__Requests = {}
+        self.__Samples = {}
+
+    # Records Getter() at each of Frames under Key.  Getter must return a
+    # copy, as the matrices Blender hands out follow the current frame.
+    def Request(self, Key, Frames, Getter):
+        for Frame in Frames:
+            self.__Requests.setdefault(int(Frame), {})[Key] = Getter
+
+    def Run(self):
+        if not self.__Requests:
+            return 0, 0
+        BlenderCurrentFrame = self.Scene.frame_current
+        for Frame in sorted(self.__Requests):
+            self.Scene.frame_set(Frame)
+            for Key, Getter in self.__Requests[Frame].items():
+                self.__Samples[Key, Frame] = Getter()
+        self.Scene.frame_set(BlenderCurrentFrame)
+        return len(self.__Requests), len(self.__Samples)
+
+    def Sample(self, Key, Frame):
+        return self.__Samples[Key, int(Frame)]
 
 
 # Creates a list of Animation objects based on the animation needs of the
-# ExportObject passed to it
+# ExportObject passed to it.  The generator works out which frames it needs
+# and requests them from the TimelineSampler; BuildKeys() turns the recorded
+# matrices into keys once the sampler has run.
 class AnimationGenerator:  # Base class, do not use
-    def __init__(self, config, SafeName, ExportObject, modeldefTree):
+    def __init__(self, config, SafeName, ExportObject, modeldefTree, Sampler):
         self.config = config
         self.SafeName = SafeName
         self.ExportObject = ExportObject
         self.modeldefTree = modeldefTree
+        self.Sampler = Sampler
 
         self.Animations = []
 
+    # "Public" Interface
+
+    def BuildKeys(self):
+        pass
+
+    # "Protected" Interface
+
+    # Rotation (as quaternion rows) and translation of each of Matrices
+    @staticmethod
+    def _Decompose(Matrices):
+        Rotations = np.array([Matrix.to_quaternion() for Matrix in Matrices], dtype=np.float64).reshape(-1, 4)
+        Positions = np.array([Matrix.to_translation() for Matrix in Matrices], dtype=np.float64).reshape(-1, 3)
+        return Rotations, Positions
+
 
 # Creates one Animation object that contains the rotation, scale, and position
 # of the ExportObject
 class GenericAnimationGenerator(AnimationGenerator):
-    def __init__(self, config, SafeName, ExportObject, modeldefTree):
-        AnimationGenerator.__init__(self, config, SafeName, ExportObject, modeldefTree)
+    def __init__(self, config, SafeName, ExportObject, modeldefTree, Sampler):
+        AnimationGenerator.__init__(self, config, SafeName, ExportObject, modeldefTree, Sampler)
 
+        self.__Animation = None
+        self.__Frames = []
+        self.__Transform = None
         self._GenerateKeys()
 
+    # "Public" Interface
+
+    def BuildKeys(self):
+        if self.__Animation is None:
+            return
+        if self.__Transform is not None:
+            MatrixAt = self.__Transform.MatrixLocal
+        else:
+            Key = ("matrix_local", self.ExportObject.BlenderObject)
+            MatrixAt = lambda Frame: self.Sampler.Sample(Key, Frame)
+        (RotBase,), (PosBase,) = self._Decompose([MatrixAt(0)])
+        Rotations, Positions = self._Decompose([MatrixAt(Frame) for Frame in self.__Frames])
+        self.__Animation.SetKeys(self.__Frames, QuaternionDifference(Rotations, RotBase), Positions - PosBase)
+
     # "Protected" Interface
 
     def _GenerateKeys(self):
@@ -1475,15 +1646,10 @@ class GenericAnimationGenerator(AnimationGenerator):
         if (not self.ExportObject.BlenderObject.fsx_anim_tag):
             return
         print("_GenerateKeys fsx_anim_tag", self.ExportObject.BlenderObject.fsx_anim_tag)
-        Scene = bpy.context.scene  # Convenience alias
-        BlenderCurrentFrame = Scene.frame_current
-        Scene.frame_set(0)
 
         CurrentAnimation = Animation(self.ExportObject.SafeName)
         BlenderObject = self.ExportObject.BlenderObject
         CurrentAnimation.AnimTag = BlenderObject.fsx_anim_tag
-        RotBase = BlenderObject.matrix_local.to_quaternion()
-        PosBase = BlenderObject.matrix_local.to_translation()
         FCurves = None
         try:
             FCurves = BlenderObject.animation_data.action.fcurves
@@ -1496,6 +1662,8 @@ class GenericAnimationGenerator(AnimationGenerator):
 
 
         # if there is a constraint applied to the object, we need to capture every frame
+        Frames = {}
+        Path = "sampled (constraints)" if BlenderObject.constraints else "sampled (no animation data)"
         if BlenderObject.constraints or not BlenderObject.animation_data:
             print("_GenerateKeys - animation tag", BlenderObject.fsx_anim_tag)
             modeldefRoot = self.modeldefTree.getroot()
@@ -1516,11 +1684,7 @@ class GenericAnimationGenerator(AnimationGenerator):
                         raise ExportError("Couldn't determine length of animation!")
             CurrentAnimation.KeyRange = framerange
 
-            for Frame in range(framerange + 1):
-                Scene.frame_set(Frame)
-
-                CurrentAnimation.RotationKeys[Frame] = BlenderObject.matrix_local.to_quaternion().rotation_difference(RotBase)
-                CurrentAnimation.PositionKeys[Frame] = BlenderObject.matrix_local.to_translation() - PosBase
+            Frames = dict.fromkeys(range(framerange + 1))
 
         # if there are no constraints applied to the object, just collect the keyframes
         elif FCurves is not None:
@@ -1534,39 +1698,64 @@ class GenericAnimationGenerator(AnimationGenerator):
                 # collect keyframe data
                 for KeyFrame in fcu.keyframe_points:
                     Frame = int(KeyFrame.co[0])  # Changed to explicit conversion to int, due to 3.1 API changes https://wiki.blender.org/wiki/Reference/Release_Notes/3.1/Python_API  Dave_W
-                    if Frame not in CurrentAnimation.RotationKeys.keys():
-                        Scene.frame_set(Frame)
-                        CurrentAnimation.PositionKeys[Frame] = BlenderObject.matrix_local.to_translation() - PosBase
-                        CurrentAnimation.RotationKeys[Frame] = BlenderObject.matrix_local.to_quaternion().rotation_difference(RotBase)
+                    Frames[Frame] = None
 
                 if fcu.range()[1] > CurrentAnimation.KeyRange:
                     CurrentAnimation.KeyRange = fcu.range()[1]
 
+            # the keys come straight from the F-Curves unless something
+            # else moves the object too
+            self.__Transform, Path = FCurveTransform.ForObject(BlenderObject)
+
         if CurrentAnimation.KeyRange > 0:
             self.Animations.append(CurrentAnimation)
-        Scene.frame_set(BlenderCurrentFrame)
+            self.__Animation = CurrentAnimation
+            self.__Frames = list(Frames)
+            self.ExportObject.Exporter.log.log("Animation of {}: {}".format(BlenderObject.name, Path), False, True)
+            if self.__Transform is None:
+                self.Sampler.Request(("matrix_local", BlenderObject), [0] + self.__Frames,
+                                     lambda: BlenderObject.matrix_local.copy())
 
 
 # Creates an Animation object for the ArmatureExportObject it gets passed and
 # an Animation object for each bone in the armature (if options allow)
 # looks like this function is never called -  no other references in the py files.
 class ArmatureAnimationGenerator(GenericAnimationGenerator):
-    def __init__(self, config, SafeName, ArmatureExportObject, modeldefTree):
+    def __init__(self, config, SafeName, ArmatureExportObject, modeldefTree, Sampler):
         GenericAnimationGenerator.__init__(self, config, SafeName,
-                                           ArmatureExportObject, modeldefTree)
+                                           ArmatureExportObject, modeldefTree, Sampler)
 
+        self.__BoneAnimations = []
+        self.__FrameRange = 0
         if self.config.ExportSkinWeights:
             self._GenerateBoneKeys()
 
+    # "Public" Interface
+
+    def BuildKeys(self):
+        GenericAnimationGenerator.BuildKeys(self)
+
+        ArmatureObject = self.ExportObject.BlenderObject
+        Frames = range(self.__FrameRange + 1)
+        for Bone, BoneAnimation in self.__BoneAnimations:
+            Rotations, Positions = self._Decompose([self.Sampler.Sample(("armature pose", ArmatureObject, Bone.name), Frame)
+                                                    for Frame in Frames])
+
+            RestBone = ArmatureObject.data.bones[Bone.name]
+            if Bone.parent:
+                LocVector = RestBone.head_local - RestBone.parent.head_local
+            else:
+                LocVector = RestBone.head_local
+
+            # y and z swapped
+            BoneAnimation.SetKeys(Frames, QuaternionConjugate(Rotations),
+                                  Positions[:, [0, 2, 1]] - np.array(LocVector))
+
     # "Protected" Interface
 
     def _GenerateBoneKeys(self):
         from itertools import zip_longest as zip
 
-        Scene = bpy.context.scene  # Convenience alias
-        BlenderCurrentFrame = Scene.frame_current
-        Scene.frame_set(0)
-
         ArmatureObject = self.ExportObject.BlenderObject
         ArmatureSafeName = self.ExportObject.SafeName
 
@@ -1580,8 +1769,8 @@ class ArmatureAnimationGenerator(GenericAnimationGenerator):
 
         root = self.modeldefTree.getroot()
         # Create Animation objects for each bone
-        BoneAnimations = [Animation(ArmatureSafeName + "_" + \
-                          Util.SafeName(Bone.name)) for Bone in AnimatedBones]
+        BoneAnimations = [Animation(self.ExportObject.Exporter.FrameNames.Get(Bone.bone,
+                          ArmatureSafeName + "_" + Util.SafeName(Bone.name))) for Bone in AnimatedBones]
 
         framerange = 0
         for Bone, BoneAnimation in zip(AnimatedBones, BoneAnimations):
@@ -1596,63 +1785,79 @@ class ArmatureAnimationGenerator(GenericAnimationGenerator):
                             framerange = int(fcu.range()[1])
             BoneAnimation.KeyRange = framerange
 
-        for Frame in range(framerange + 1):
-            Scene.frame_set(Frame)
-
-            for Bone, BoneAnimation in zip(AnimatedBones, BoneAnimations):
-
-                RestBone = ArmatureObject.data.bones[Bone.name]
-                if Bone.parent:
-                    PoseMatrix = Bone.parent.matrix.inverted() @ Bone.matrix
-                    LocVector = RestBone.head_local - RestBone.parent.head_local
-                else:
-                    PoseMatrix = RestBone.matrix_local.inverted() @ Bone.matrix
-                    LocVector = RestBone.head_local
-
-                Rotation = PoseMatrix.to_quaternion()
-                Rotation.conjugate()
-                Position = PoseMatrix.to_translation()
-                yPos = Position[1]
-                Position[1] = Position[2]
-                Position[2] = yPos
-                Position -= LocVector
+        # The pose of each bone relative to its parent, or to its rest
+        # position for root bones
+        def PoseMatrix(Bone):
+            if Bone.parent:
+                return Bone.parent.matrix.inverted() @ Bone.matrix
+            return ArmatureObject.data.bones[Bone.name].matrix_local.inverted() @ Bone.matrix
 
-                BoneAnimation.RotationKeys[Frame] = Rotation
-                BoneAnimation.PositionKeys[Frame] = Position
+        for Bone in AnimatedBones:
+            self.Sampler.Request(("armature pose", ArmatureObject, Bone.name), range(framerange + 1),
+                                 lambda Bone=Bone: PoseMatrix(Bone))
 
+        self.__BoneAnimations = list(zip(AnimatedBones, BoneAnimations))
+        self.__FrameRange = framerange
         self.Animations += BoneAnimations
-        Scene.frame_set(BlenderCurrentFrame)
 
 
 class BoneAnimationGenerator(AnimationGenerator):
-    def __init__(self, config, SafeName, BoneExportObject, modeldefTree):
+    def __init__(self, config, SafeName, BoneExportObject, modeldefTree, Sampler):
         AnimationGenerator.__init__(self, config, SafeName,
-                                    BoneExportObject, modeldefTree)
+                                    BoneExportObject, modeldefTree, Sampler)
 
+        self.__Animation = None
+        self.__Constrained = False
+        self.__Frames = []
+        self.__Transform = None
         if self.config.ExportSkinWeights:
             self._GenerateBoneKeys()
 
+    # "Public" Interface
+
+    def BuildKeys(self):
+        if self.__Animation is None:
+            return
+        Armature = self.ExportObject.ParentArmature
+        Name = self.ExportObject.BlenderObject.name
+        Matrix_base = self.Sampler.Sample(("pose", Armature, Name), 0)
+
+        if self.__Constrained:
+            (Quaternion_base,), (Translation_base,) = self._Decompose([Matrix_base])
+            Rotations, Positions = self._Decompose([self.Sampler.Sample(("pose", Armature, Name), Frame)
+                                                    for Frame in self.__Frames])
+            Rotations = QuaternionConjugate(-QuaternionDifference(Quaternion_base, Rotations))
+            Positions = Positions - Translation_base
+        else:
+            if self.__Transform is not None:
+                Matrices = [self.__Transform.MatrixBasis(Frame) for Frame in self.__Frames]
+            else:
+                Matrices = [self.Sampler.Sample(("matrix_basis", Armature, Name), Frame) for Frame in self.__Frames]
+            Rotations, Positions = self._Decompose(Matrices)
+            Rotations = QuaternionConjugate(Rotations)
+            Positions = Positions @ np.array(Matrix_base.to_3x3()).T
+        self.__Animation.SetKeys(self.__Frames, Rotations, Positions)
+
     # "Protected" Interface
     def _GenerateBoneKeys(self):
         Bone = self.ExportObject.BlenderObject
         if not Bone.fsx_anim_tag:
             return
         print("_GenerateBoneKeys found animation tag", Bone.fsx_anim_tag)
-        Scene = bpy.context.scene
-        BlenderCurrentFrame = Scene.frame_current
-        Scene.frame_set(0)
 
         Armature = self.ExportObject.ParentArmature
         PoseBone = Armature.pose.bones[Bone.name]
         BoneAnimation = Animation(self.ExportObject.SafeName)
         BoneAnimation.AnimTag = Bone.fsx_anim_tag
-        if PoseBone.parent:
-            Matrix_base = PoseBone.parent.matrix.inverted() @ PoseBone.matrix
-        else:
-            Matrix_base = PoseBone.matrix
-        Quaternion_base = Matrix_base.to_quaternion()
-        Translation_base = Matrix_base.to_translation()
 
+        # The pose of the bone relative to its parent
+        def PoseMatrix():
+            if PoseBone.parent:
+                return PoseBone.parent.matrix.inverted() @ PoseBone.matrix
+            return PoseBone.matrix.copy()
+
+        Frames = {}
+        Path = "sampled (constraints)"
         if PoseBone.constraints:
             print("_GenerateBoneKeys - PoseBone.Constraints", PoseBone.constraints)
             root = self.modeldefTree.getroot()
@@ -1668,21 +1873,8 @@ class BoneAnimationGenerator(AnimationGenerator):
             BoneAnimation.KeyRange = framerange
 
             print("_GenerateBoneKeys PoseBone", PoseBone)
-            for Frame in range(framerange + 1):
-                print("_GenerateBoneKeys - Pose constraint Frame Loop", Frame)
-                Scene.frame_set(int(Frame))
-
-                if PoseBone.parent:
-                    PoseMatrix = PoseBone.parent.matrix.inverted() @ PoseBone.matrix
-                else:
-                    PoseMatrix = PoseBone.matrix
-
-                Rotation = -1 * Quaternion_base.rotation_difference(PoseMatrix.to_quaternion())
-                Rotation.conjugate()
-                Position = PoseMatrix.to_translation() - Translation_base
-
-                BoneAnimation.RotationKeys[Frame] = Rotation
-                BoneAnimation.PositionKeys[Frame] = Position
+            Frames = dict.fromkeys(range(framerange + 1))
+            self.__Constrained = True
         elif (Armature.animation_data is not None):   # added to catch error
             if Armature.animation_data.action is not None:
                 print("_GenerateBoneKeys - Armature.animation_data.action.fcurves")
@@ -1700,21 +1892,16 @@ class BoneAnimationGenerator(AnimationGenerator):
 
                         print("_GenerateBoneKeys - Bonename", Bone.name)
                         for KeyFrame in fcu.keyframe_points:
-                            Frame = KeyFrame.co[0]
-                            if Frame not in BoneAnimation.RotationKeys.keys():
-                                print("_GenerateBoneKeys - Frame", Frame)
-                                Scene.frame_set(int(Frame))
-                                Rotation = PoseBone.matrix_basis.to_quaternion()
-                                Rotation.conjugate()
-                                Position = PoseBone.matrix_basis.to_translation()
-                                Position = Matrix_base.to_3x3() @ Position
-
-                                BoneAnimation.RotationKeys[Frame] = Rotation
-                                BoneAnimation.PositionKeys[Frame] = Position
+                            Frames[KeyFrame.co[0]] = None
 
                     if fcu.range()[1] > BoneAnimation.KeyRange:
                         BoneAnimation.KeyRange = fcu.range()[1]
+
+                # the keys come straight from the F-Curves unless something
+                # else moves the bone too
+                self.__Transform, Path = FCurveTransform.ForPoseBone(Armature, PoseBone)
             else:
+                Path = "sampled (NLA tracks)"
                 print("BoneAnimationGenerator - skipped Armature Bones Keys no action - check NLAs", Armature, Armature.animation_data, Armature.animation_data.nla_tracks )
                 for nlatrack in Armature.animation_data.nla_tracks:
                     if not nlatrack.mute:
@@ -1735,17 +1922,7 @@ class BoneAnimationGenerator(AnimationGenerator):
 
                                     print("_GenerateBoneKeys - Bonename", Bone.name)
                                     for KeyFrame in fcu.keyframe_points:
-                                        Frame = KeyFrame.co[0]
-                                        if Frame not in BoneAnimation.RotationKeys.keys():
-                                            print("_GenerateBoneKeys - Frame NLATrack strip", Frame)
-                                            Scene.frame_set(int(Frame)) # int correct here
-                                            Rotation = PoseBone.matrix_basis.to_quaternion()
-                                            Rotation.conjugate()
-                                            Position = PoseBone.matrix_basis.to_translation()
-                                            Position = Matrix_base.to_3x3() @ Position
-
-                                            BoneAnimation.RotationKeys[Frame] = Rotation
-                                            BoneAnimation.PositionKeys[Frame] = Position
+                                        Frames[KeyFrame.co[0]] = None
 
                                 if fcu.range()[1] > BoneAnimation.KeyRange:
                                     BoneAnimation.KeyRange = fcu.range()[1]
@@ -1753,4 +1930,11 @@ class BoneAnimationGenerator(AnimationGenerator):
             print("BoneAnimationGenerator - skipped Armature Bones Keys no data", Armature, Armature.animation_data)
         if BoneAnimation.KeyRange > 0:
             self.Animations.append(BoneAnimation)
-        Scene.frame_set(BlenderCurrentFrame)
+            self.__Animation = BoneAnimation
+            self.__Frames = list(Frames)
+            self.ExportObject.Exporter.log.log("Animation of {}: {}".format(self.ExportObject.name, Path), False, True)
+            self.Sampler.Request(("pose", Armature, Bone.name),
+                                 [0] + (self.__Frames if self.__Constrained else []), PoseMatrix)
+            if not self.__Constrained and self.__Transform is None:
+                self.Sampler.Request(("matrix_basis", Armature, Bone.name), self.__Frames,
+                                     lambda: PoseBone.matrix_basis.copy())
@@ -62,7 +62,7 @@ import bpy
 import os
 from bpy.types import Operator
 from bpy_extras.io_utils import ExportHelper, ImportHelper
-from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatProperty, IntProperty
 
 
 class ExportFSX(Operator, ExportHelper):
@@ -99,12 +99,46 @@ class ExportFSX(Operator, ExportHelper):
         default=False
     )
 
+    ReduceKeyframes: BoolProperty(
+        name="Reduce Keyframes",
+        description="Drop the animation keys that interpolating between the keys around them reproduces within the tolerances",
+        default=False
+    )
+
+    KeyframePositionTolerance: FloatProperty(
+        name="Key position tolerance",
+        description="Largest position error a dropped key may leave",
+        default=0.0005,
+        min=0.0,
+        max=1.0,
+        precision=5
+    )
+
+    KeyframeRotationTolerance: FloatProperty(
+        name="Key rotation tolerance",
+        description="Largest rotation error a dropped key may leave",
+        subtype='ANGLE',
+        default=0.001,
+        min=0.0,
+        max=0.1,
+        precision=4
+    )
+
     ExportSkinWeights: BoolProperty(
         name="Skinned Mesh - Vertex Grouped Armatures",
         description="Export skinned or piston animations - All armatures should be vertex grouped",
         default=False
     )
 
+    SkinWeightThreshold: FloatProperty(
+        name="Skin weight threshold",
+        description="Bone influences lighter than this are dropped before the four heaviest of each vertex are kept",
+        default=0.0,
+        min=0.0,
+        max=1.0,
+        precision=4
+    )
+
     ExportMDL: BoolProperty(
         name="Export MDL",
         description="Export MDL file",
@@ -143,6 +177,71 @@ class ExportFSX(Operator, ExportHelper):
         default=False
     )
 
+    XFileFormat: EnumProperty(
+        name="X File Format",
+        description="Encoding of the intermediate .x file handed to XToMdl",
+        items=(('TEXT', "Text", "Human readable .x file"),
+               ('BINARY', "Binary", "Binary .x file, smaller and faster to write and read"),
+               ('TZIP', "Compressed Text", "MSZIP compressed text .x file"),
+               ('BZIP', "Compressed Binary", "MSZIP compressed binary .x file")),
+        default='TEXT'
+    )
+
+    Jobs: IntProperty(
+        name="Jobs",
+        description="Worker processes formatting mesh data for text .x files (0 uses one per core, 1 formats in Blender)",
+        default=1,
+        min=0,
+        max=64
+    )
+
+    Pipelined: BoolProperty(
+        name="Pipelined Writing",
+        description="Format and write the text .x file in a background thread while the next objects are evaluated",
+        default=False
+    )
+
+    ExportInstances: BoolProperty(
+        name="Export Instances",
+        description="Export the meshes of collection instances and geometry nodes instances, each one as a frame sharing the mesh of its source",
+        default=False
+    )
+
+    Triangulation: EnumProperty(
+        name="Triangulation",
+        description="How faces with more than three corners are split into triangles",
+        items=(('LOOPTRIS', "Loop Triangles", "Use the triangles Blender already computed for the mesh"),
+               ('BMESH', "BMesh", "Triangulate a copy of the mesh with bmesh")),
+        default='LOOPTRIS'
+    )
+
+    WeldVertices: BoolProperty(
+        name="Weld Vertices",
+        description="Share one vertex between face corners with identical position, normal, UVs and weights",
+        default=True
+    )
+
+    NormalTolerance: FloatProperty(
+        name="Normal merge tolerance",
+        description="Smooth normals closer than this are written only once",
+        default=1.1920929e-07,
+        min=1e-9,
+        max=0.01,
+        precision=8
+    )
+
+    UseChunkCache: BoolProperty(
+        name="Cache Mesh Chunks",
+        description="Keep the serialized meshes in a cache folder next to the .x file and reuse them for objects that did not change",
+        default=False
+    )
+
+    Incremental: BoolProperty(
+        name="Incremental Export",
+        description="Meshes only: splice the meshes of objects that did not change since the last export from the mesh chunk cache (turned on with it) without evaluating them, and skip XToMdl if nothing changed. Frames and animations are always written again",
+        default=False
+    )
+
     use_writeToFile: BoolProperty(
         name="Write to File",
         description="The write to file command is adding an additional step to the export to flush the memory. Use only if you experience OOM errors.",
@@ -164,9 +263,48 @@ class ExportFSX(Operator, ExportHelper):
         row.prop(self, "ApplyModifiers")
         row = layout.row()
         row.prop(self, "ExportAnimation")
+
+        row = layout.row()
+        row.prop(self, "ReduceKeyframes")
+
+        row = layout.row()
+        row.prop(self, "KeyframePositionTolerance")
+
+        row = layout.row()
+        row.prop(self, "KeyframeRotationTolerance")
         row = layout.row()
         row.prop(self, "ExportSkinWeights")
 
+        row = layout.row()
+        row.prop(self, "SkinWeightThreshold")
+
+        row = layout.row()
+        row.prop(self, "XFileFormat")
+
+        row = layout.row()
+        row.prop(self, "Jobs")
+
+        row = layout.row()
+        row.prop(self, "Pipelined")
+
+        row = layout.row()
+        row.prop(self, "ExportInstances")
+
+        row = layout.row()
+        row.prop(self, "Triangulation")
+
+        row = layout.row()
+        row.prop(self, "WeldVertices")
+
+        row = layout.row()
+        row.prop(self, "NormalTolerance")
+
+        row = layout.row()
+        row.prop(self, "UseChunkCache")
+
+        row = layout.row()
+        row.prop(self, "Incremental")
+
         row = layout.row()
         row.prop(self, "ExportMDL")
         if ((context.scene.global_sdk == 'p3dv3') or (context.scene.global_sdk == 'p3dv4') or (context.scene.global_sdk == 'p3dv5') or (context.scene.global_sdk == 'p3dv6')):
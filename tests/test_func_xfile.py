@@ -0,0 +1,185 @@
+# Round trips of compressed .x files through MSZipStream and Decompress, and
+# through the file writers of func_util.
+#
+# func_xfile needs no bpy, but the add-on package imports it on import, so
+# the module is loaded straight from its file.  The writers need bpy; their
+# modules are imported without running the package __init__.
+
+import importlib
+import importlib.util
+import io
+import os
+import sys
+import types
+import zlib
+
+import numpy as np
+import pytest
+
+_Directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Blender2P3DFSX")
+_Spec = importlib.util.spec_from_file_location("func_xfile", os.path.join(_Directory, "func_xfile.py"))
+func_xfile = importlib.util.module_from_spec(_Spec)
+_Spec.loader.exec_module(func_xfile)
+
+
+def _ImportWriters():
+    pytest.importorskip("bpy")
+    if "Blender2P3DFSX" not in sys.modules:
+        Package = types.ModuleType("Blender2P3DFSX")
+        Package.__path__ = [_Directory]
+        sys.modules["Blender2P3DFSX"] = Package
+    return importlib.import_module("Blender2P3DFSX.func_util")
+
+
+# Keeps what was written to it after MSZipStream closes it
+class _Output(io.BytesIO):
+    def close(self):
+        self.Data = self.getvalue()
+        io.BytesIO.close(self)
+
+
+# Writes Payload through an MSZipStream in pieces that do not line up with
+# its blocks, and returns the whole compressed file
+def _Compress(Payload, Format, Piece=10000):
+    Output = _Output()
+    Stream = func_xfile.MSZipStream(Output, Format)
+    for Start in range(0, len(Payload), Piece):
+        Stream.write(Payload[Start:Start + Piece])
+    Stream.close()
+    return Output.Data
+
+
+# Reference reader of compressed .x files, written from the format and not
+# from func_xfile: a 16 byte signature, the DWORD size of the uncompressed
+# file, then blocks of WORD uncompressed size, WORD compressed size + 2, "CK"
+# and a raw deflate stream primed with the previous block.  Returns the
+# format and the inflated blocks (the uncompressed file without its
+# signature).
+def _Inflate(Data):
+    assert Data[:8] == b"xof 0302" and Data[12:16] == b"0032"
+    Size = int.from_bytes(Data[16:20], "little")
+    Blocks = []
+    Position = 20
+    while Position < len(Data):
+        Uncompressed = int.from_bytes(Data[Position:Position + 2], "little")
+        Compressed = int.from_bytes(Data[Position + 2:Position + 4], "little")
+        assert 0 < Uncompressed <= 32768
+        assert Data[Position + 4:Position + 6] == b"CK"
+        if Blocks:
+            Decompressor = zlib.decompressobj(-15, zdict=Blocks[-1])
+        else:
+            Decompressor = zlib.decompressobj(-15)
+        Block = Decompressor.decompress(Data[Position + 6:Position + 4 + Compressed])
+        assert Decompressor.eof and not Decompressor.unused_data
+        assert len(Block) == Uncompressed
+        Blocks.append(Block)
+        Position += 4 + Compressed
+    assert Position == len(Data)
+    Inflated = b"".join(Blocks)
+    assert Size == 16 + len(Inflated)
+    return Data[8:12], Inflated
+
+
+def _Vertices():
+    return np.random.default_rng(0).uniform(-100.0, 100.0, (4000, 3))
+
+
+def _Faces():
+    Counts = np.tile([3, 4], 1000)
+    Indexes = np.random.default_rng(1).integers(0, 4000, Counts.sum())
+    return Counts, Indexes
+
+
+def _TextPayload():
+    Vertices = _Vertices()
+    Text = "\n\nMesh {{\n  {};\n{}}}\n".format(
+        len(Vertices), func_xfile.FormatBlock(Vertices, "  "))
+    return Text.encode("utf-8")
+
+
+def _BinaryPayload():
+    Vertices = _Vertices()
+    Encoder = func_xfile.BinaryEncoder()
+    Encoder.Feed("Mesh {{\n  {};\n".format(len(Vertices)))
+    Encoder.FeedArray(Vertices)
+    Encoder.Feed("}\n")
+    Encoder.Finish()
+    return Encoder.Take()
+
+
+# The same model through any of the writers
+def _WriteModel(File):
+    Vertices = _Vertices()
+    Counts, Indexes = _Faces()
+    File.Open()
+    File.WriteSignature()
+    File.Write("Frame Root {\n")
+    File.Indent()
+    File.Write("Mesh { // Root mesh\n")
+    File.Indent()
+    File.Write("{};\n".format(len(Vertices)))
+    File.WriteArray(Vertices)
+    File.Write("{};\n".format(len(Counts)))
+    File.WriteIndexArray(Counts, Indexes)
+    File.Unindent()
+    File.Write("} // End of Root mesh\n")
+    File.Unindent()
+    File.Write("}\n")
+    File.Close()
+
+
+def _Read(Path):
+    with open(Path, 'rb') as Input:
+        return Input.read()
+
+
+@pytest.mark.parametrize("Format, Uncompressed, MakePayload", [
+    ("tzip", "txt ", _TextPayload),
+    ("bzip", "bin ", _BinaryPayload),
+])
+def test_round_trip(Format, Uncompressed, MakePayload):
+    Payload = MakePayload()
+    assert len(Payload) > func_xfile.MSZipStream.BlockSize
+
+    Compressed = _Compress(Payload, Format)
+    assert Compressed[:16] == func_xfile.Signature(Format).encode("ascii")
+    assert len(Compressed) < len(Payload)
+
+    Expected = func_xfile.Signature(Uncompressed).encode("ascii") + Payload
+    assert func_xfile.Decompress(Compressed) == Expected
+    assert _Inflate(Compressed) == (Format.encode("ascii"), Payload)
+
+
+def test_whole_blocks():
+    Payload = _TextPayload()
+    Payload = Payload[:len(Payload) - len(Payload) % func_xfile.MSZipStream.BlockSize]
+
+    Compressed = _Compress(Payload, "tzip")
+    Expected = func_xfile.Signature("txt ").encode("ascii") + Payload
+    assert func_xfile.Decompress(Compressed) == Expected
+    assert _Inflate(Compressed) == (b"tzip", Payload)
+
+
+# A compressed file from the writers holds exactly the file they write
+# uncompressed
+@pytest.mark.parametrize("Binary, Pipelined", [(False, False), (False, True), (True, False)])
+def test_writers(tmp_path, Binary, Pipelined):
+    func_util = _ImportWriters()
+    Plain = str(tmp_path / "plain.x")
+    Compressed = str(tmp_path / "compressed.x")
+    if Binary:
+        _WriteModel(func_util.BinaryFile(Plain))
+        _WriteModel(func_util.BinaryFile(Compressed, True))
+    else:
+        _WriteModel(func_util.File(Plain, Pipelined=Pipelined))
+        _WriteModel(func_util.File(Compressed, True, Pipelined=Pipelined))
+
+    Expected = _Read(Plain)
+    Data = _Read(Compressed)
+    assert len(Expected) > func_xfile.MSZipStream.BlockSize
+    assert func_xfile.Decompress(Data) == Expected
+
+    Format, Inflated = _Inflate(Data)
+    assert Format == (b"bzip" if Binary else b"tzip")
+    assert Expected[:16] == func_xfile.Signature("bin " if Binary else "txt ").encode("ascii")
+    assert Inflated == Expected[16:]